@@ -25,9 +25,8 @@ from quart_cors import cors
 import socketio
 
 from utils import Config, get_logger, atee, sentence_segment
-from services.gpt import GPT
-from services.tts import TTS
-from services.player import Player
+from services.session import SessionManager, SESSION_HEADER
+from services.gpt import get_rag_index
 
 logging = get_logger()
 
@@ -35,6 +34,8 @@ CORS_ALLOWED_ORIGINS = "*"
 
 host = Config.get("host", "127.0.0.1")
 port = Config.get("port", 5002)
+STREAM_BUFFER = Config.get("GPT", {}).get("stream_buffer", 1024)
+STREAM_POLICY = Config.get("GPT", {}).get("stream_policy", "block")
 
 
 class QuartSIO:
@@ -82,23 +83,6 @@ app = QuartSIO()
 home_dir = os.getcwd()
 
 
-tasks = set()
-def tasks_cancel():
-    """
-    取消并清理所有正在运行的异步任务
-    
-    该函数遍历全局tasks集合中的所有异步任务,
-    对每个任务执行取消操作并标记为完成。
-    主要用于在开始新对话或应用关闭时确保没有遗留的任务继续运行。
-    """
-    global tasks
-    task: asyncio.Task
-    for task in tasks:
-        if not task.done():
-            task.cancel()
-    tasks.clear()
-
-
 @app.on('connect', namespace='/ue') # type: ignore
 async def connet(sid, environ):
     logging.info(f"Connected: {sid}")
@@ -109,64 +93,131 @@ async def disconnect(sid):
     logging.info(f"Disconnected: {sid}")
 
 
+def get_session_id(data: dict | None = None) -> str | None:
+    """
+    获取请求对应的会话ID
+    
+    优先读取请求头中的会话ID，其次读取请求体中的session_id或conversation_id字段，
+    均未提供时返回None，由会话管理器使用默认会话。
+    """
+    session_id = request.headers.get(SESSION_HEADER)
+    if not session_id and data:
+        session_id = data.get("session_id") or data.get("conversation_id")
+    return session_id
+
+
+async def chat_stream(session, message: str, start_time: float | None = None):
+    """
+    对话流水线
+    
+    调用GPT生成回复，同时将文本分句、转换为语音并播放，
+    并行处理文本生成和语音合成。HTTP接口和进程内的ASR共用该流程。
+    
+    Args:
+        session: 对话所属的会话
+        message: 用户消息
+        start_time: 请求开始时间，用于统计首字和首次播放时间
+        
+    Yields:
+        bytes: OpenAI兼容的SSE输出
+    """
+    gpt, tts, player = session.gpt, session.tts, session.player
+    start_time = start_time or time.time()
+    
+    session.snapshot = gpt.snapshot(session.id)
+    gpt_stream = gpt.generate_stream(message, session.id)
+    
+    # 每个SSE事件只解析一次，再分发给TTS、HTTP响应和日志统计
+    text_deltas, output_deltas, log_deltas, task = await atee(
+        gpt.delta_stream(gpt_stream), 3, maxsize=STREAM_BUFFER, policy=STREAM_POLICY
+    )
+    session.add_task(task)
+    session.create_task(gpt.log_stream(log_deltas, start_time))
+    
+    policy = session.chunk_policy
+    if policy is not None:
+        policy.start()
+    
+    sentence_stream = sentence_segment(gpt.create_text_stream(text_deltas, session.id), policy)
+    
+    audio_stream = tts.audio_generate(sentence_stream, policy)
+    
+    audio_queue = asyncio.Queue()
+                    
+    audio_gen_task = session.create_task(tts.run(audio_stream, audio_queue))
+    play_task = session.create_task(player.run(audio_queue, start_time))
+    
+    output_stream = gpt.output_stream(output_deltas)
+                
+    try:
+        async for data in output_stream:
+            yield data
+        
+        await audio_gen_task
+        await play_task
+    except asyncio.CancelledError:
+        logging.info(f"Chat cancelled: {session.id}")
+        raise
+    finally:
+        # 正常结束时两个任务都已完成；出错或取消时停止合成和播放，避免会话一直处于忙碌状态
+        audio_gen_task.cancel()
+        play_task.cancel()
+
+
+def ask(message: str, session_id: str | None = None) -> asyncio.Task:
+    """
+    在进程内提问
+    
+    供ASR直接调用，与HTTP接口共用会话和取消逻辑，在后台任务中完成整个对话流程，
+    不经过HTTP回环。
+    
+    Args:
+        message: 用户消息
+        session_id: 会话ID，为空时使用默认会话
+        
+    Returns:
+        asyncio.Task: 对话任务，会话被取消时随之取消
+    """
+    session = sessions.get(session_id)
+    session.cancel()
+    start_time = time.time()
+    
+    async def consume():
+        try:
+            async for _ in chat_stream(session, message, start_time):
+                pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Failed to chat: {e}")
+    
+    return session.create_task(consume())
+
+
 @app.route('/v1/chat/completions', methods=['POST'])
 async def chat():
     """
     处理聊天完成请求的主函数
     
     该函数接收用户消息，调用GPT生成回复，同时将文本转换为语音并播放
-    实现了并行处理文本生成和语音合成的流程
     
     Returns:
         Response: 包含生成文本的流式响应
     """
-    global tasks
-    tasks_cancel()
-    
     data: dict = await request.json
     messages: list[dict] = data.get("messages", [])
     if not messages:
         return jsonify({"error": "Message is required"}), 400
     message = messages[0].get("content", "")
     
-    start_time = time.time()
+    session = sessions.get(get_session_id(data))
+    session.cancel()
     
-    async def generate():
-        gpt_stream = gpt.generate_stream(message)
-        
-        stream1, stream2, task = await atee(gpt_stream)
-        tasks.add(task)
-        
-        sentence_stream = sentence_segment(gpt.create_text_stream(stream1))
-        
-        audio_stream = tts.audio_generate(sentence_stream)
-        
-        audio_queue = asyncio.Queue()
-                        
-        audio_gen_task = asyncio.create_task(tts.run(audio_stream, audio_queue))
-        tasks.add(audio_gen_task)
-        play_task = asyncio.create_task(player.run(audio_queue, start_time))
-        tasks.add(play_task)
-        
-        output_stream = gpt.output_stream(stream2)
-                    
-        try:
-            async for data in output_stream:
-                yield data
-            
-            await audio_gen_task
-            await play_task
-        except asyncio.CancelledError:
-            logging.info("Chat cancelled")
-            audio_gen_task.cancel()
-            play_task.cancel()
-            raise
-        else:
-            tasks.clear()
+    start_time = time.time()
     
     try:
         return Response(
-            generate(),
+            chat_stream(session, message, start_time),
             mimetype="text/event-stream"
         )
     except Exception as e:
@@ -176,26 +227,44 @@ async def chat():
 
 @app.route('/v1/chat/new', methods=['GET'])
 async def new_chat():
-    tasks_cancel()
-    GPT.reset_body()
+    sessions.reset(get_session_id(request.args))
     return jsonify({"message": "New chat started"}), 200
 
+
+@app.route('/v1/rag/status', methods=['GET'])
+async def rag_status():
+    """
+    RAG索引的就绪状态，索引未就绪时返回503
+    """
+    index = get_rag_index()
+    if index is None:
+        return jsonify({"enabled": False, "state": "disabled", "ready": False, "documents": 0}), 200
+    status = index.status()
+    return jsonify({"enabled": True, **status}), 200 if status["ready"] else 503
+
                 
 if __name__ == '__main__':
-    gpt = GPT()
-    tts = TTS()
-    player = Player(app)
+    sessions = SessionManager(app)
     
     asr_task = None
     
     async def main():
+        index = get_rag_index()
+        if index is not None:
+            # 在后台构建RAG索引，不阻塞服务启动
+            index.start()
+        
         if Config.get("ASR", "").get("enable", False):
             global asr_task
             from services.asr import ASR
-            asr = ASR(app, tasks_cancel)
+            asr = ASR(app, sessions.cancel, ask, sessions.rollback)
             asr_task = asyncio.create_task(asr.run_forever())
         
-        await app._run()
+        try:
+            await app._run()
+        finally:
+            # 退出前停止所有会话正在进行的回复和播放
+            sessions.cancel_all()
     
     try:
         asyncio.run(main())
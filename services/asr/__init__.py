@@ -3,21 +3,23 @@ from utils import Config
 
 mode = Config.get("ASR", "").get("mode", "wake")
 player_mode = Config.get("Player", "").get("mode", "local")
+# 这些播放模式在本进程内播放，识别结果直接在进程内发起对话
+LOCAL_PLAYER_MODES = ("local", "pcm", "null")
 
 
-def ASR(socketio, tasks_cancel_func):
+def ASR(socketio, tasks_cancel_func, chat_func=None, rollback_func=None):
     if mode == "wake":
-        if player_mode == "local":
+        if player_mode in LOCAL_PLAYER_MODES:
             from .local import WakeLocal
-            return WakeLocal(socketio=socketio, tasks_cancel_func=tasks_cancel_func)
+            return WakeLocal(socketio=socketio, tasks_cancel_func=tasks_cancel_func, chat_func=chat_func)
         else:
             return Wake(socketio=socketio, tasks_cancel_func=tasks_cancel_func)
     elif mode == "realtime":
-        if player_mode == "local":
+        if player_mode in LOCAL_PLAYER_MODES:
             from .local import RealtimeLocal
-            return RealtimeLocal(socketio=socketio, tasks_cancel_func=tasks_cancel_func)
+            return RealtimeLocal(socketio=socketio, tasks_cancel_func=tasks_cancel_func, chat_func=chat_func, rollback_func=rollback_func)
         else:
             from .realtime import Realtime
-            return Realtime(socketio=socketio, tasks_cancel_func=tasks_cancel_func)
+            return Realtime(socketio=socketio, tasks_cancel_func=tasks_cancel_func, rollback_func=rollback_func)
     else:
         raise ValueError(f"Invalid ASR mode: {mode}")
@@ -0,0 +1,308 @@
+"""
+离线批量语音识别
+
+通过一组FunASR websocket连接并发识别多个WAV/PCM文件，用于在录制的音频上
+回归测试识别准确率和吞吐量。offline模式下音频不按实时速度发送，
+每个文件返回识别文本、分段时间戳和耗时。
+
+作者: 光明实验室媒体智能团队
+"""
+
+import os
+import json
+import time
+import asyncio
+from dataclasses import dataclass, field, asdict
+
+import numpy as np
+
+from utils import Config, get_logger
+from utils.audio import AudioBuffer, Resampler
+from .funasr_wss_client import RATE, FunASRClient
+
+logging = get_logger()
+asr_config = Config.get("ASR", {}) or {}
+config = asr_config.get("FunASR", {}) or {}
+batch_config = asr_config.get("Batch", {}) or {}
+
+
+@dataclass(slots=True)
+class Segment:
+    """
+    服务端返回的一段离线识别结果
+
+    Attributes:
+        text: 识别文本
+        timestamps: 每个字的[开始, 结束]时间（毫秒），服务端未返回时为空
+    """
+    text: str
+    timestamps: list = field(default_factory=list)
+
+
+    @property
+    def start(self) -> int | None:
+        return self.timestamps[0][0] if self.timestamps else None
+
+
+    @property
+    def end(self) -> int | None:
+        return self.timestamps[-1][1] if self.timestamps else None
+
+
+@dataclass(slots=True)
+class BatchResult:
+    """
+    一个文件的识别结果
+
+    Attributes:
+        name: 音频名称（scp中的名称或文件名）
+        path: 音频路径
+        text: 完整识别文本
+        segments: 分段结果和时间戳
+        duration: 音频时长（秒），无法解码的格式为0
+        elapsed: 从开始发送到收到最终结果的耗时（秒）
+        error: 识别失败时的错误信息
+    """
+    name: str
+    path: str
+    text: str = ""
+    segments: list[Segment] = field(default_factory=list)
+    duration: float = 0.0
+    elapsed: float = 0.0
+    error: str = ""
+
+
+    @property
+    def rtf(self) -> float:
+        """实时率，耗时除以音频时长"""
+        return self.elapsed / self.duration if self.duration else 0.0
+
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def load_audio(path: str, samplerate: int = RATE) -> tuple[bytes, str, float]:
+    """
+    读取音频文件
+
+    WAV文件解码后转为单声道并重采样到16kHz的16位PCM；.pcm文件视为samplerate采样率的
+    单声道16位PCM；其他格式原样发送，由服务端解码。
+
+    Args:
+        path: 音频路径
+        samplerate: .pcm文件的采样率
+
+    Returns:
+        tuple[bytes, str, float]: 音频数据、FunASR的wav_format、时长（秒）
+    """
+    with open(path, "rb") as file:
+        data = file.read()
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".wav":
+        audio = AudioBuffer.from_wav(data)
+        pcm, source_rate = audio.mono(), audio.samplerate
+    elif extension == ".pcm":
+        pcm, source_rate = np.frombuffer(data, "<i2").astype(np.float32) / 32768, samplerate
+    else:
+        return data, "others", 0.0
+
+    pcm = Resampler(source_rate, RATE).process(pcm)
+    pcm = (np.clip(pcm, -1, 1) * 32767).astype("<i2")
+    return pcm.tobytes(), "pcm", len(pcm) / RATE
+
+
+def read_list(path: str) -> list[tuple[str, str]]:
+    """
+    读取待识别的文件列表
+
+    Args:
+        path: 音频文件、包含音频的目录，或每行“名称 路径”的scp列表
+
+    Returns:
+        list[tuple[str, str]]: (名称, 路径)列表
+    """
+    if os.path.isdir(path):
+        files = sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if os.path.splitext(name)[1].lower() in (".wav", ".pcm")
+        )
+        return [(os.path.splitext(os.path.basename(file))[0], file) for file in files]
+
+    if path.endswith(".scp"):
+        items = []
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                parts = line.strip().split(maxsplit=1)
+                if len(parts) == 2:
+                    items.append((parts[0], parts[1]))
+                elif parts:
+                    items.append((os.path.splitext(os.path.basename(parts[0]))[0], parts[0]))
+        return items
+
+    return [(os.path.splitext(os.path.basename(path))[0], path)]
+
+
+def parse_timestamps(value) -> list:
+    """
+    解析服务端返回的timestamp字段，C++服务端返回JSON字符串，Python服务端返回列表
+    """
+    if not value:
+        return []
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return []
+    return value if isinstance(value, list) else []
+
+
+class BatchTranscriber:
+    """
+    并发的离线批量识别
+
+    建立connections个websocket连接，每个连接依次识别文件队列中的文件，
+    一个文件识别完成后在同一连接上开始下一个文件。连接出错时重新连接并重试该文件一次。
+    """
+    def __init__(
+        self,
+        connections: int | None = None,
+        mode: str | None = None,
+        timeout: float | None = None,
+        settle: float | None = None,
+        config: dict = config,
+    ):
+        self.samplerate = batch_config.get("samplerate", RATE)
+
+        self.connections = max(connections or batch_config.get("connections", 4), 1)
+        self.client = FunASRClient(config, mode or batch_config.get("mode", "offline"))
+        # 单个文件发送完成后等待最终结果的最长时间
+        self.timeout = timeout or batch_config.get("timeout", 30)
+        # 服务端不返回is_final时，收到离线结果后settle秒内没有新结果即认为识别完成
+        self.settle = settle if settle is not None else batch_config.get("settle", 0.5)
+
+
+    async def send(self, websocket, name: str, audio: bytes, wav_format: str):
+        await websocket.send(self.client.start_message(name, audio_fs=RATE, wav_format=wav_format))
+        stride = self.client.chunk_frames * 2
+        interval = self.client.chunk_frames / RATE
+        start = time.monotonic()
+        for i, offset in enumerate(range(0, len(audio), stride)):
+            await websocket.send(audio[offset:offset + stride])
+            if self.client.mode != "offline":
+                # 流式模型需要按实时速度送入音频
+                delay = start + (i + 1) * interval - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+        await websocket.send(self.client.end_message())
+
+
+    async def receive(self, websocket, sent: asyncio.Future, result: BatchResult):
+        """
+        接收一个文件的识别结果，直到服务端返回is_final，或者发送完成后收到离线结果并静默settle秒
+        """
+        online = ""
+        endpoint = False
+        deadline = None
+        while True:
+            if sent.done():
+                if deadline is None:
+                    deadline = time.monotonic() + self.timeout
+                timeout = deadline - time.monotonic()
+                if endpoint:
+                    timeout = min(timeout, self.settle)
+            else:
+                # 发送过程中定期检查发送是否完成
+                timeout = 0.1
+
+            try:
+                message = await asyncio.wait_for(websocket.recv(), max(timeout, 0))
+            except asyncio.TimeoutError:
+                if not sent.done():
+                    continue
+                if not endpoint:
+                    result.error = "Timed out waiting for the final result"
+                break
+
+            data = json.loads(message)
+            mode = data.get("mode")
+            if mode is None:
+                continue
+            text = data.get("text", "")
+            if mode in ("offline", "2pass-offline"):
+                online = ""
+                if text:
+                    result.segments.append(Segment(text, parse_timestamps(data.get("timestamp"))))
+                endpoint = sent.done()
+            else:
+                online += text
+            result.text = "".join(segment.text for segment in result.segments) + online
+            if data.get("is_final", False) and sent.done():
+                break
+
+
+    async def transcribe_one(self, websocket, name: str, path: str) -> BatchResult:
+        result = BatchResult(name=name, path=path)
+        try:
+            audio, wav_format, result.duration = load_audio(path, self.samplerate)
+        except Exception as e:
+            result.error = f"Failed to read audio: {e}"
+            return result
+
+        start = time.monotonic()
+        sent = asyncio.get_running_loop().create_future()
+        receiver = asyncio.create_task(self.receive(websocket, sent, result))
+        try:
+            await self.send(websocket, name, audio, wav_format)
+            sent.set_result(None)
+            await receiver
+        finally:
+            receiver.cancel()
+        result.elapsed = time.monotonic() - start
+        return result
+
+
+    async def run_connection(self, queue: asyncio.Queue, results: dict, progress=None):
+        websocket = None
+        try:
+            while not queue.empty():
+                index, name, path = queue.get_nowait()
+                for attempt in range(2):
+                    try:
+                        if websocket is None:
+                            websocket = await self.client.connect()
+                        results[index] = await self.transcribe_one(websocket, name, path)
+                        break
+                    except Exception as e:
+                        logging.warning(f"ASR batch connection failed on {name}: {e!r}")
+                        if websocket is not None:
+                            await websocket.close()
+                            websocket = None
+                        results[index] = BatchResult(name=name, path=path, error=repr(e))
+                if progress is not None:
+                    progress(results[index])
+        finally:
+            if websocket is not None:
+                await websocket.close()
+
+
+    async def transcribe(self, items: list[tuple[str, str]], progress=None) -> list[BatchResult]:
+        """
+        并发识别多个文件
+
+        Args:
+            items: (名称, 路径)列表
+            progress: 每个文件完成时调用的回调，参数为BatchResult
+
+        Returns:
+            list[BatchResult]: 与items顺序一致的识别结果
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        for index, (name, path) in enumerate(items):
+            queue.put_nowait((index, name, path))
+
+        results: dict[int, BatchResult] = {}
+        workers = min(self.connections, len(items))
+        await asyncio.gather(*(self.run_connection(queue, results, progress) for _ in range(workers)))
+        return [results[index] for index in range(len(items))]
@@ -1,394 +1,252 @@
 # -*- encoding: utf-8 -*-
+"""
+FunASR websocket客户端
+
+FunASRClient封装连接参数、握手消息和热词，Transcript按FunASR的结果类型拼接识别文本。
+模块导入时不解析命令行、不打印，ASR工作进程和批量识别共用这些类。
+命令行入口只在直接运行时生效：
+
+    python -m services.asr.funasr_wss_client                  # 识别麦克风
+    python -m services.asr.funasr_wss_client --audio_in a.wav # 识别文件或scp列表
+"""
+
 import os
-import time
-import websockets, ssl
-import asyncio
-# import threading
-import argparse
+import ssl
 import json
-import yaml
-import traceback
-from multiprocessing import Process, Pipe
-# from asr.fileio.datadir_writer import DatadirWriter
+import asyncio
 
-import logging
+from utils import Config, get_logger
 
-from utils import Config
+logging = get_logger()
+home_dir = os.getcwd()
+config = (Config.get("ASR", {}) or {}).get("FunASR", {}) or {}
 
-logging.basicConfig(level=logging.ERROR)
+RATE = 16000
 
-home_dir = os.getcwd()
 
-config = Config.get("ASR", "").get("FunASR", "")
-
-parser = argparse.ArgumentParser()
-parser.add_argument("--host",
-                    type=str,
-                    default=config.get("ip", "localhost"),
-                    required=False,
-                    help="host ip, localhost, 0.0.0.0")
-parser.add_argument("--port",
-                    type=int,
-                    default=config.get("port", 10096),
-                    required=False,
-                    help="grpc server port")
-parser.add_argument("--chunk_size",
-                    type=str,
-                    default="5, 10, 5",
-                    help="chunk")
-parser.add_argument("--chunk_interval",
-                    type=int,
-                    default=10,
-                    help="chunk")
-parser.add_argument("--hotword",
-                    type=str,
-                    default=f'{home_dir}/configs/hotword.txt',
-                    help="hotword file path, one hotword perline (e.g.:阿里巴巴 20)")
-parser.add_argument("--audio_in",
-                    type=str,
-                    default=None,
-                    help="audio_in")
-parser.add_argument("--audio_fs",
-                    type=int,
-                    default=16000,
-                    help="audio_fs")
-parser.add_argument("--send_without_sleep",
-                    action="store_true",
-                    default=True,
-                    help="if audio_in is set, send_without_sleep")
-parser.add_argument("--thread_num",
-                    type=int,
-                    default=1,
-                    help="thread_num")
-parser.add_argument("--words_max_print",
-                    type=int,
-                    default=10000,
-                    help="chunk")
-parser.add_argument("--output_dir",
-                    type=str,
-                    default=None,
-                    help="output_dir")
-parser.add_argument("--ssl",
-                    type=int,
-                    default=config.get("ssl", 0),
-                    help="1 for ssl connect, 0 for no ssl")
-parser.add_argument("--use_itn",
-                    type=int,
-                    default=1,
-                    help="1 for using itn, 0 for not itn")
-parser.add_argument("--mode",
-                    type=str,
-                    default=config.get("mode", "2pass"),
-                    help="offline, online, 2pass")
-
-args = parser.parse_args()
-args.chunk_size = [int(x) for x in args.chunk_size.split(",")]
-print(args)
-# voices = asyncio.Queue()
-from queue import Queue
-
-voices = Queue()
-offline_msg_done=False
-
-if args.output_dir is not None:
-    # if os.path.exists(args.output_dir):
-    #     os.remove(args.output_dir)
-        
-    if not os.path.exists(args.output_dir):
-        os.makedirs(args.output_dir)
-
-
-async def record_microphone():
-    is_finished = False
-    import pyaudio
-    # print("2")
-    global voices
-    FORMAT = pyaudio.paInt16
-    CHANNELS = 1
-    RATE = 16000
-    chunk_size = 60 * args.chunk_size[1] / args.chunk_interval
-    CHUNK = int(RATE / 1000 * chunk_size)
-
-    p = pyaudio.PyAudio()
-
-    stream = p.open(format=FORMAT,
-                    channels=CHANNELS,
-                    rate=RATE,
-                    input=True,
-                    frames_per_buffer=CHUNK)
-    # hotwords
-    fst_dict = {}
-    hotword_msg = ""
-    if args.hotword.strip() != "":
-        f_scp = open(args.hotword)
-        hot_lines = f_scp.readlines()
-        for line in hot_lines:
-            words = line.strip().split(" ")
-            if len(words) < 2:
-                print("Please checkout format of hotwords")
-                continue
-            try:
-                fst_dict[" ".join(words[:-1])] = int(words[-1])
-            except ValueError:
-                print("Please checkout format of hotwords")
-        hotword_msg=json.dumps(fst_dict)
-
-    use_itn=True
-    if args.use_itn == 0:
-        use_itn=False
-    
-    message = json.dumps({"mode": args.mode, "chunk_size": args.chunk_size, "chunk_interval": args.chunk_interval,
-                          "wav_name": "microphone", "is_speaking": True, "hotwords":hotword_msg, "itn": use_itn})
-    #voices.put(message)
-    await websocket.send(message)
-    while True:
-        data = stream.read(CHUNK)
-        message = data
-        #voices.put(message)
-        await websocket.send(message)
-        await asyncio.sleep(0.005)
-
-async def record_from_scp(chunk_begin, chunk_size):
-    global voices
-    is_finished = False
-    if args.audio_in.endswith(".scp"):
-        f_scp = open(args.audio_in)
-        wavs = f_scp.readlines()
-    else:
-        wavs = [args.audio_in]
-
-    # hotwords
-    fst_dict = {}
-    hotword_msg = ""
-    if args.hotword.strip() != "":
-        f_scp = open(args.hotword)
-        hot_lines = f_scp.readlines()
-        for line in hot_lines:
-            words = line.strip().split(" ")
-            if len(words) < 2:
-                print("Please checkout format of hotwords")
-                continue
-            try:
-                fst_dict[" ".join(words[:-1])] = int(words[-1])
-            except ValueError:
-                print("Please checkout format of hotwords")
-        hotword_msg=json.dumps(fst_dict)
-        print (hotword_msg)
-
-    sample_rate = args.audio_fs
-    wav_format = "pcm"
-    use_itn=True
-    if args.use_itn == 0:
-        use_itn=False
-     
-    if chunk_size > 0:
-        wavs = wavs[chunk_begin:chunk_begin + chunk_size]
-    for wav in wavs:
-        wav_splits = wav.strip().split()
- 
-        wav_name = wav_splits[0] if len(wav_splits) > 1 else "demo"
-        wav_path = wav_splits[1] if len(wav_splits) > 1 else wav_splits[0]
-        if not len(wav_path.strip())>0:
-           continue
-        if wav_path.endswith(".pcm"):
-            with open(wav_path, "rb") as f:
-                audio_bytes = f.read()
-        elif wav_path.endswith(".wav"):
-            import wave
-            with wave.open(wav_path, "rb") as wav_file:
-                params = wav_file.getparams()
-                sample_rate = wav_file.getframerate()
-                frames = wav_file.readframes(wav_file.getnframes())
-                audio_bytes = bytes(frames)        
-        else:
-            wav_format = "others"
-            with open(wav_path, "rb") as f:
-                audio_bytes = f.read()
-
-        stride = int(60 * args.chunk_size[1] / args.chunk_interval / 1000 * sample_rate * 2)
-        chunk_num = (len(audio_bytes) - 1) // stride + 1
-        # print(stride)
-
-        # send first time
-        message = json.dumps({"mode": args.mode, "chunk_size": args.chunk_size, "chunk_interval": args.chunk_interval, "audio_fs":sample_rate,
-                          "wav_name": wav_name, "wav_format": wav_format, "is_speaking": True, "hotwords":hotword_msg, "itn": use_itn})
-
-        #voices.put(message)
-        await websocket.send(message)
-        is_speaking = True
-        for i in range(chunk_num):
-
-            beg = i * stride
-            data = audio_bytes[beg:beg + stride]
-            message = data
-            #voices.put(message)
-            await websocket.send(message)
-            if i == chunk_num - 1:
-                is_speaking = False
-                message = json.dumps({"is_speaking": is_speaking})
-                #voices.put(message)
-                await websocket.send(message)
- 
-            sleep_duration = 0.001 if args.mode == "offline" else 60 * args.chunk_size[1] / args.chunk_interval / 1000
-            
-            await asyncio.sleep(sleep_duration)
-    
-    if not args.mode=="offline":
-        await asyncio.sleep(2)
-    # offline model need to wait for message recved
-    
-    if args.mode=="offline":
-      global offline_msg_done
-      while  not  offline_msg_done:
-         await asyncio.sleep(1)
-    
-    await websocket.close()
-
-
-          
-async def message(id, conn):
-    global websocket,voices,offline_msg_done
-    text_print = ""
-    text_print_2pass_online = ""
-    text_print_2pass_offline = ""
-    if args.output_dir is not None:
-        ibest_writer = open(os.path.join(args.output_dir, "text.{}".format(id)), "a", encoding="utf-8")
-    else:
-        ibest_writer = None
+def load_hotwords(path: str) -> str:
+    """
+    读取热词文件，每行一个热词和权重（如：阿里巴巴 20）
+
+    Returns:
+        str: FunASR要求的JSON格式热词
+    """
+    if not path or not os.path.exists(path):
+        return ""
+    with open(path, "rb") as file:
+        data = file.read()
     try:
-       while True:
-        
-            meg = await websocket.recv()
-            meg = json.loads(meg)
-            wav_name = meg.get("wav_name", "demo")
-            text = meg["text"]
-            timestamp=""
-            offline_msg_done = meg.get("is_final", False)
-            if "timestamp" in meg:
-                timestamp = meg["timestamp"]
-
-            if ibest_writer is not None:
-                if timestamp !="":
-                    text_write_line = "{}\t{}\t{}\n".format(wav_name, text, timestamp)
-                else:
-                    text_write_line = "{}\t{}\n".format(wav_name, text)
-                ibest_writer.write(text_write_line)
-
-            if 'mode' not in meg:
-                continue
-            if meg["mode"] == "online":
-                text_print += "{}".format(text)
-                text_print = text_print[-args.words_max_print:]
-                os.system('clear')
-                print("\rpid" + str(id) + ": " + text_print)
-            elif meg["mode"] == "offline":
-                if timestamp !="":
-                    text_print += "{} timestamp: {}".format(text, timestamp)
-                else:
-                    text_print += "{}".format(text)
-
-                # text_print = text_print[-args.words_max_print:]
-                # os.system('clear')
-                print("\rpid" + str(id) + ": " + wav_name + ": " + text_print)
-                offline_msg_done = True
-            else:
-                if meg["mode"] == "2pass-online":
-                    text_print_2pass_online += "{}".format(text)
-                    text_print = text_print_2pass_offline + text_print_2pass_online
-                else:
-                    text_print_2pass_online = ""
-                    text_print = text_print_2pass_offline + "{}".format(text)
-                    text_print_2pass_offline += "{}".format(text)
-                text_print = text_print[-args.words_max_print:]
-                # os.system('cls')
-                # print(text_print)
-                conn.send(text_print)
-                # offline_msg_done=True
-
-    except Exception as e:
-            print("Exception:", e)
-            #traceback.print_exc()
-            #await websocket.close()
- 
-
-
-
-async def ws_client(id, chunk_begin, chunk_size, conn):
-  if args.audio_in is None:
-       chunk_begin=0
-       chunk_size=1
-  global websocket,voices,offline_msg_done
- 
-  for i in range(chunk_begin,chunk_begin+chunk_size):
-    offline_msg_done=False
-    voices = Queue()
-    if args.ssl == 1:
-        ssl_context = ssl.SSLContext()
-        ssl_context.check_hostname = False
-        ssl_context.verify_mode = ssl.CERT_NONE
-        uri = "wss://{}:{}".format(args.host, args.port)
-    else:
-        uri = "ws://{}:{}".format(args.host, args.port)
-        ssl_context = None
-    print("connect to", uri)
-    async with websockets.connect(uri, subprotocols=["binary"], ping_interval=None, ssl=ssl_context) as websocket: # type: ignore
-        if args.audio_in is not None:
-            task = asyncio.create_task(record_from_scp(i, 1))
+        lines = data.decode("utf-8").splitlines()
+    except UnicodeDecodeError:
+        # Windows上编辑的热词文件通常是GBK编码
+        lines = data.decode("gbk", errors="replace").splitlines()
+
+    hotwords = {}
+    for line in lines:
+        words = line.strip().split(" ")
+        if len(words) < 2:
+            continue
+        try:
+            hotwords[" ".join(words[:-1])] = int(words[-1])
+        except ValueError:
+            logging.warning(f"Invalid hotword line: {line.strip()}")
+    return json.dumps(hotwords, ensure_ascii=False) if hotwords else ""
+
+
+class FunASRClient:
+    """
+    FunASR websocket服务的连接配置
+
+    Args:
+        config: FunASR配置（ip, port, ssl, mode, chunk_size, chunk_interval, use_itn, hotword）
+        mode: 覆盖配置中的识别模式
+    """
+    def __init__(self, config: dict = config, mode: str | None = None):
+        self.host = config.get("ip", "localhost")
+        self.port = config.get("port", 10096)
+        self.ssl = config.get("ssl", 0)
+        self.mode = mode or config.get("mode", "2pass")
+        self.chunk_size = [int(x) for x in str(config.get("chunk_size", "5, 10, 5")).split(",")]
+        self.chunk_interval = config.get("chunk_interval", 10)
+        self.use_itn = bool(config.get("use_itn", 1))
+        self.hotwords = load_hotwords(config.get("hotword", f"{home_dir}/configs/hotword.txt"))
+
+
+    @property
+    def uri(self) -> str:
+        return f"{'wss' if self.ssl else 'ws'}://{self.host}:{self.port}"
+
+
+    @property
+    def chunk_frames(self) -> int:
+        """每块音频的帧数（16kHz）"""
+        chunk_ms = 60 * self.chunk_size[1] / self.chunk_interval
+        return int(RATE / 1000 * chunk_ms)
+
+
+    def ssl_context(self) -> ssl.SSLContext | None:
+        if not self.ssl:
+            return None
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        return context
+
+
+    async def connect(self):
+        """
+        建立websocket连接
+
+        Returns:
+            websockets的客户端连接，可用作异步上下文管理器
+        """
+        import websockets
+
+        return await websockets.connect(
+            self.uri, subprotocols=["binary"], ping_interval=None, ssl=self.ssl_context(), max_size=None # type: ignore
+        )
+
+
+    def start_message(self, wav_name: str = "microphone", **extra) -> str:
+        """
+        开始一段语音的握手消息
+
+        Args:
+            wav_name: 语音名称，服务端在结果中原样返回
+            extra: 其他字段，如audio_fs, wav_format
+        """
+        return json.dumps({
+            "mode": self.mode, "chunk_size": self.chunk_size, "chunk_interval": self.chunk_interval,
+            "wav_name": wav_name, "is_speaking": True, "hotwords": self.hotwords, "itn": self.use_itn,
+            **extra,
+        })
+
+
+    @staticmethod
+    def end_message() -> str:
+        """结束当前语音，服务端返回剩余的离线结果并清空识别状态"""
+        return json.dumps({"is_speaking": False})
+
+
+class Transcript:
+    """
+    拼接一段语音的识别文本
+
+    online和offline模式的结果依次追加；2pass模式下离线结果替换之前对应的在线结果。
+    """
+    def __init__(self):
+        self.text = ""
+        self.offline = ""
+        self.online = ""
+
+
+    def clear(self):
+        self.text = ""
+        self.offline = ""
+        self.online = ""
+
+
+    def update(self, mode: str, text: str) -> str:
+        """
+        加入一条识别结果
+
+        Returns:
+            str: 目前的完整文本
+        """
+        if mode in ("online", "offline"):
+            self.text += text
+        elif mode == "2pass-online":
+            self.online += text
+            self.text = self.offline + self.online
         else:
-            task = asyncio.create_task(record_microphone())
-        task3 = asyncio.create_task(message(str(id)+"_"+str(i), conn)) #processid+fileid
-        await asyncio.gather(task, task3)
-  exit(0)
-    
+            self.online = ""
+            self.offline += text
+            self.text = self.offline
+        return self.text
 
-def one_thread(id, chunk_begin, chunk_size, conn):
-    asyncio.get_event_loop().run_until_complete(ws_client(id, chunk_begin, chunk_size, conn))
-    asyncio.get_event_loop().run_forever()
 
-if __name__ == '__main__':
-    # for microphone
+async def recognize_microphone(client: FunASRClient):
+    """
+    识别麦克风输入并在终端中刷新当前文本
+    """
+    import pyaudio
+
+    audio = pyaudio.PyAudio()
+    stream = audio.open(format=pyaudio.paInt16, channels=1, rate=RATE, input=True, frames_per_buffer=client.chunk_frames)
+    transcript = Transcript()
+    loop = asyncio.get_running_loop()
+
+    async with await client.connect() as websocket:
+        await websocket.send(client.start_message())
+
+        async def send():
+            while True:
+                data = await loop.run_in_executor(None, stream.read, client.chunk_frames, False)
+                await websocket.send(data)
+
+        async def receive():
+            async for message in websocket:
+                result = json.loads(message)
+                if "mode" in result:
+                    print(f"\r{transcript.update(result['mode'], result.get('text', ''))}", end="", flush=True)
+
+        try:
+            await asyncio.gather(send(), receive())
+        finally:
+            stream.close()
+            audio.terminate()
+
+
+async def recognize_files(path: str, connections: int, output_dir: str | None, client_config: dict):
+    """
+    并发识别音频文件，结果写入output_dir/text，每行为名称、文本和时间戳
+    """
+    from .batch import BatchTranscriber, read_list
+
+    transcriber = BatchTranscriber(connections=connections, mode=client_config["mode"], config=client_config)
+    results = await transcriber.transcribe(read_list(path))
+    writer = None
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+        writer = open(os.path.join(output_dir, "text"), "w", encoding="utf-8")
+    try:
+        for result in results:
+            line = f"{result.name}\t{result.error or result.text}"
+            print(line)
+            if writer is not None:
+                timestamps = [stamp for segment in result.segments for stamp in segment.timestamps]
+                writer.write(f"{line}\t{json.dumps(timestamps)}\n" if timestamps else f"{line}\n")
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="FunASR websocket client")
+    parser.add_argument("--host", type=str, default=config.get("ip", "localhost"), help="host ip, localhost, 0.0.0.0")
+    parser.add_argument("--port", type=int, default=config.get("port", 10096), help="server port")
+    parser.add_argument("--chunk_size", type=str, default="5, 10, 5", help="chunk")
+    parser.add_argument("--chunk_interval", type=int, default=10, help="chunk")
+    parser.add_argument("--hotword", type=str, default=f"{home_dir}/configs/hotword.txt", help="hotword file path, one hotword perline (e.g.:阿里巴巴 20)")
+    parser.add_argument("--audio_in", type=str, default=None, help="wav/pcm file, directory or scp list; microphone if not set")
+    parser.add_argument("--thread_num", type=int, default=1, help="number of concurrent connections for audio_in")
+    parser.add_argument("--output_dir", type=str, default=None, help="output_dir")
+    parser.add_argument("--ssl", type=int, default=config.get("ssl", 0), help="1 for ssl connect, 0 for no ssl")
+    parser.add_argument("--use_itn", type=int, default=1, help="1 for using itn, 0 for not itn")
+    parser.add_argument("--mode", type=str, default=config.get("mode", "2pass"), help="offline, online, 2pass")
+    args = parser.parse_args()
+
+    client_config = {
+        "ip": args.host, "port": args.port, "ssl": args.ssl, "mode": args.mode, "chunk_size": args.chunk_size,
+        "chunk_interval": args.chunk_interval, "use_itn": args.use_itn, "hotword": args.hotword,
+    }
     if args.audio_in is None:
-        p = Process(target=one_thread, args=(0, 0, 0))
-        p.start()
-        p.join()
-        print('end')
+        asyncio.run(recognize_microphone(FunASRClient(client_config)))
     else:
-        # calculate the number of wavs for each preocess
-        if args.audio_in.endswith(".scp"):
-            f_scp = open(args.audio_in)
-            wavs = f_scp.readlines()
-        else:
-            wavs = [args.audio_in]
-        for wav in wavs:
-            wav_splits = wav.strip().split()
-            wav_name = wav_splits[0] if len(wav_splits) > 1 else "demo"
-            wav_path = wav_splits[1] if len(wav_splits) > 1 else wav_splits[0]
-            audio_type = os.path.splitext(wav_path)[-1].lower()
-
-
-        total_len = len(wavs)
-        if total_len >= args.thread_num:
-            chunk_size = int(total_len / args.thread_num)
-            remain_wavs = total_len - chunk_size * args.thread_num
-        else:
-            chunk_size = 1
-            remain_wavs = 0
-
-        process_list = []
-        chunk_begin = 0
-        for i in range(args.thread_num):
-            now_chunk_size = chunk_size
-            if remain_wavs > 0:
-                now_chunk_size = chunk_size + 1
-                remain_wavs = remain_wavs - 1
-            # process i handle wavs at chunk_begin and size of now_chunk_size
-            p = Process(target=one_thread, args=(i, chunk_begin, now_chunk_size))
-            chunk_begin = chunk_begin + now_chunk_size
-            p.start()
-            process_list.append(p)
-
-        for i in process_list:
-            p.join()
-
-        print('end')
+        asyncio.run(recognize_files(args.audio_in, args.thread_num, args.output_dir, client_config))
 
+
+if __name__ == '__main__':
+    main()
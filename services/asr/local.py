@@ -1,50 +1,32 @@
 from .wake import Wake
 from .realtime import Realtime
-import requests
-import threading
-from utils import Config, get_logger
+from utils import get_logger
 
 logging = get_logger()
 
-host = Config.get("host", "127.0.0.1")
-port = Config.get("port", 5002)
 
-
-def send_request(text):
+def ask(chat_func, text: str):
+    """
+    在进程内发起对话，不等待回答完成，以便继续监听下一句话
+    """
+    if not text:
+        return
+    if chat_func is None:
+        logging.error("No chat function configured for local ASR")
+        return
     try:
-        response = requests.post(
-            f"http://{host}:{port}/v1/chat/completions",
-            json={"messages": [{"content": text}]},
-            timeout=30,
-            stream=True
-        )
-        response.raise_for_status()
-        for chunk in response.iter_content(chunk_size=1024):
-            pass
+        chat_func(text)
     except Exception as e:
-        pass
+        logging.error(f"Failed to start chat: {e}")
 
 
 class WakeLocal(Wake):
     async def run(self):
         text = await super().run()
-        
-        try:
-            thread = threading.Thread(target=send_request, args=(text,))
-            thread.daemon = True
-            thread.start()
-        except Exception as e:
-            logging.error(f"Failed to create request thread: {e}")
+        ask(self.chat_func, text)
             
 
 class RealtimeLocal(Realtime):
     async def run(self):
         text = await super().run()
-        
-        try:
-            thread = threading.Thread(target=send_request, args=(text,))
-            thread.daemon = True
-            thread.start()
-        except Exception as e:
-            logging.error(f"Failed to create request thread: {e}")
-
+        ask(self.chat_func, text)
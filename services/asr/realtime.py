@@ -1,40 +1,117 @@
 from .wake import Wake
 import time
 import asyncio
-from utils import get_logger
+from utils import Config, get_logger
 
 logging = get_logger()
+config = Config.get("ASR", "")
 
 
 class Realtime(Wake):
+    def __init__(self, socketio, tasks_cancel_func, chat_func=None, rollback_func=None):
+        super().__init__(socketio=socketio, tasks_cancel_func=tasks_cancel_func, chat_func=chat_func)
+        # 撤销被合并的投机提问及其回答的函数，为空时只取消回答
+        self.rollback_func = rollback_func
+        # 本地VAD判断说完后，等待服务端离线结果的最长时间
+        self.offline_wait = config.get("offline_wait", 0.5)
+        # 投机模式：收到离线结果立即提问，用户在merge_window内继续说话时打断回答，并与之前的内容合并后重新提问
+        self.speculative = config.get("speculative", False)
+        self.merge_window = config.get("merge_window", 2.0)
+        self.speculated_at: float | None = None
+
+
+    def process_start(self):
+        if self.speculated_at is not None and time.monotonic() - self.speculated_at < self.merge_window:
+            # 合并窗口内不清空识别状态
+            self.worker.start()
+            return
+        self.speculated_at = None
+        super().process_start()
+
+
+    def finalize(self, text: str, reason: str) -> str:
+        logging.info(f"Utterance finalized by {reason}")
+        self.speculated_at = time.monotonic() if self.speculative else None
+        return text
+
+
     async def speech(self):
-        current_time = time.time()
+        """
+        获取用户的一句话
+
+        收到服务端的离线结果（2pass-offline或is_final）且本地VAD认为已经停止说话时立即结束；
+        本地VAD认为停止说话后offline_wait秒内没有等到离线结果时，使用目前的文本结束；
+        超过timeout没有新的识别结果作为兜底。
+
+        Returns:
+            str: 识别出的文本
+        """
         text: str = ""
+        speaking = False
+        endpoint = False
+        last_text = 0.0
+        silent_at: float | None = None
+        merging = self.speculated_at is not None
+
         try:
             while True:
-                if self.parent_conn is not None and self.parent_conn.poll():
-                    self.tasks_cancel_func()
-                    text = self.parent_conn.recv()
-                    logging.info(f"ASR: {text}")
-                    current_time = time.time()
-                    
-                if time.time() - current_time > self.timeout and text:
-                    return text
-                await asyncio.sleep(0.01)
+                now = time.monotonic()
+                deadlines = []
+                if merging:
+                    deadlines.append(self.speculated_at + self.merge_window)
+                if text:
+                    deadlines.append(last_text + self.timeout)
+                    if silent_at is not None:
+                        deadlines.append(silent_at + self.offline_wait)
+                timeout = max(min(deadlines) - now, 0) if deadlines else None
+
+                try:
+                    result = await asyncio.wait_for(self.worker.get(), timeout)
+                except asyncio.TimeoutError:
+                    if merging and not text:
+                        # 用户没有继续说话，之前的投机提问即为最终结果，开始新的一句
+                        merging = False
+                        self.speculated_at = None
+                        self.worker.reset()
+                        continue
+                    if silent_at is not None and time.monotonic() >= silent_at + self.offline_wait:
+                        return self.finalize(text, "local VAD")
+                    return self.finalize(text, "timeout")
+
+                now = time.monotonic()
+                if result.speaking is not None:
+                    speaking = result.speaking
+                    silent_at = None if speaking else now
+                    if not speaking and endpoint and text:
+                        return self.finalize(text, "endpoint")
+                    continue
+
+                if merging:
+                    merging = False
+                    logging.info("User kept talking, merging with the speculative question")
+                    # 合并后的问题包含之前的内容，被取代的提问和部分回答不能留在对话历史中
+                    if self.rollback_func is not None:
+                        self.rollback_func()
+                self.tasks_cancel_func()
+                text = result.text
+                last_text = now
+                endpoint = result.endpoint
+                if silent_at is not None:
+                    silent_at = now
+                logging.info(f"ASR: {text}")
+
+                if endpoint and (self.speculative or not speaking):
+                    return self.finalize(text, "endpoint")
         except Exception as e:
             logging.error(f"Speech: {e}")
             raise e
-    
-    
+
+
     async def run(self):
         self.process_start()
-        
-        try:
-            text = await self.speech()
-            logging.info(f"Recognized text: {text}")
-            
-            await self.socketio.emit("question", text, namespace="/ue")
-            return text
-        finally:
-            self.process_stop()
-        
\ No newline at end of file
+
+        text = await self.speech()
+        logging.info(f"Recognized text: {text}")
+
+        await self.socketio.emit("question", text, namespace="/ue")
+        return text
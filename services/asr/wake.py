@@ -1,20 +1,18 @@
-from multiprocessing import Process, Pipe
-from .funasr_wss_client import one_thread
+from .worker import ASRProcess
 import socketio
 import asyncio
-import time
 from utils import Config, get_logger
 
 logging = get_logger()
 config = Config.get("ASR", "")
 
 class Wake:
-    def __init__(self, socketio: socketio.AsyncServer, tasks_cancel_func):
-        self.parent_conn = None
-        self.child_conn = None
-        self.process = None
+    def __init__(self, socketio: socketio.AsyncServer, tasks_cancel_func, chat_func=None):
+        self.worker = ASRProcess()
         self.socketio = socketio
         self.tasks_cancel_func = tasks_cancel_func
+        # 在进程内发起对话的函数，本地播放模式下使用
+        self.chat_func = chat_func
         self.wake_words = config.get("wake_words", "光小明,你好,在吗")
         if isinstance(self.wake_words, str):
             self.wake_words = [w.strip() for w in self.wake_words.split(",") if w.strip()]
@@ -22,26 +20,17 @@ class Wake:
         
     
     def process_start(self):
-        if self.process is not None and self.process.is_alive():
-            self.process_stop()
-        if self.parent_conn is not None or self.child_conn is not None:
-            self.process_stop()
-            
-        self.parent_conn, self.child_conn = Pipe()
-        self.process = Process(target=one_thread, args=(0, 0, 0, self.child_conn,), daemon=True)
-        self.process.start()
+        """
+        开始监听新的一句话
         
+        常驻的ASR工作进程只在第一次调用或意外退出时启动，之后只清空识别状态
+        """
+        self.worker.start()
+        self.worker.reset()
         
-    def process_stop(self):
-        if self.parent_conn is not None:
-            self.parent_conn.close()
-            self.parent_conn = None
-        if self.child_conn is not None:
-            self.child_conn.close()
-            self.child_conn = None
-        if self.process is not None and self.process.is_alive():
-            self.process.terminate()
-            self.process = None
+        
+    async def process_stop(self):
+        await self.worker.stop()
     
     
     async def wake(self) -> str:
@@ -58,13 +47,11 @@ class Wake:
         """
         try:
             while True:
-                if self.parent_conn is not None and self.parent_conn.poll():
-                    text: str = self.parent_conn.recv()
-                    logging.info(f"ASR: {text}")
-                    for word in self.wake_words:
-                        if word in text:
-                            return word
-                await asyncio.sleep(0.01)
+                text = await self.worker.get_text()
+                logging.info(f"ASR: {text}")
+                for word in self.wake_words:
+                    if word in text:
+                        return word
         except Exception as e:
             logging.error(f"Wake: {e}")
             raise e
@@ -85,22 +72,19 @@ class Wake:
         Raises:
             Exception: 当语音识别过程出错时抛出
         """
-        current_time = time.time()
         text: str = ""
         try:
             while True:
-                if self.parent_conn is not None and self.parent_conn.poll():
-                    text = self.parent_conn.recv()
+                try:
+                    # 还没有识别到内容时一直等待，之后超过timeout没有新结果即认为说完
+                    text = await asyncio.wait_for(self.worker.get_text(), self.timeout if text else None)
                     logging.info(f"ASR: {text}")
-                    current_time = time.time()
-                    
-                if time.time() - current_time > self.timeout and text:
+                except asyncio.TimeoutError:
                     index = text.find(wake_word)
                     index += len(wake_word)
                     if index < len(text) and text[index] in "，。！？":
                         index += 1
                     return text[index:]
-                await asyncio.sleep(0.01)
         except Exception as e:
             logging.error(f"Speech: {e}")
             raise e
@@ -109,22 +93,27 @@ class Wake:
     async def run(self) -> str:
         self.process_start()
         
-        try:
-            wake_word = await self.wake()
-            logging.info(f"Wake word detected: {wake_word}")
-            
-            self.tasks_cancel_func()
-            
-            text =  await self.speech(wake_word)
-            logging.info(f"Recognized text: {text}")
-    
-            await self.socketio.emit("question", text, namespace="/ue")
-            
-            return text
-        finally:
-            self.process_stop()
+        wake_word = await self.wake()
+        logging.info(f"Wake word detected: {wake_word}")
+        
+        self.tasks_cancel_func()
+        
+        text =  await self.speech(wake_word)
+        logging.info(f"Recognized text: {text}")
+
+        await self.socketio.emit("question", text, namespace="/ue")
+        
+        return text
             
     
     async def run_forever(self):
-        while True:
-            await self.run()
+        try:
+            while True:
+                try:
+                    await self.run()
+                except Exception as e:
+                    # 工作进程意外退出时，下一轮会重新启动
+                    logging.error(f"ASR failed, restarting: {e!r}")
+                    await asyncio.sleep(1)
+        finally:
+            await self.process_stop()
@@ -0,0 +1,406 @@
+"""
+常驻ASR工作进程
+
+工作进程启动后一直保持麦克风和FunASR websocket连接，通过Pipe接收控制命令
+(reset, stop)并返回识别结果，连接断开后自动重连，
+避免每句话都重新创建进程、打开麦克风和建立连接。
+
+作者: 光明实验室媒体智能团队
+"""
+
+import json
+import time
+import asyncio
+import threading
+from dataclasses import dataclass
+from multiprocessing import Process, Pipe
+
+import numpy as np
+
+from utils import Config, get_logger
+from .funasr_wss_client import RATE, FunASRClient, Transcript
+
+logging = get_logger()
+asr_config = Config.get("ASR", {}) or {}
+config = asr_config.get("FunASR", {}) or {}
+
+# 麦克风缓冲的最大块数，断线重连期间超出的旧音频会被丢弃
+MAX_PENDING_CHUNKS = 50
+
+
+@dataclass(slots=True)
+class ASRResult:
+    """
+    工作进程返回的识别事件
+
+    Attributes:
+        text: 当前语句目前的识别文本
+        mode: FunASR结果类型 (online, offline, 2pass-online, 2pass-offline)，VAD事件为空
+        is_final: 服务端是否标记为最终结果
+        speaking: 本地VAD状态变化，True为开始说话，False为停止说话，识别结果为None
+    """
+    text: str
+    mode: str = ""
+    is_final: bool = False
+    speaking: bool | None = None
+
+
+    @property
+    def endpoint(self) -> bool:
+        """服务端认为一段语音已经结束（2pass的离线结果或最终结果）"""
+        return self.is_final or self.mode in ("offline", "2pass-offline")
+
+
+class EnergyVAD:
+    """
+    基于短时能量的本地VAD
+
+    音频块的均方根能量超过阈值即认为在说话，连续silence秒低于阈值才认为停止说话。
+    """
+    def __init__(self, threshold: float = 500, silence: float = 0.3):
+        self.threshold = threshold
+        self.silence = silence
+        self.speaking = False
+        self.quiet = 0.0
+
+
+    def update(self, data: bytes) -> bool | None:
+        """
+        处理一块16位PCM
+
+        Returns:
+            bool | None: 状态变化时返回新的状态，否则返回None
+        """
+        if self.threshold <= 0:
+            return None
+        pcm = np.frombuffer(data, np.int16).astype(np.float32)
+        if not len(pcm):
+            return None
+        loud = float(np.sqrt(np.mean(pcm * pcm))) >= self.threshold
+
+        if loud:
+            self.quiet = 0.0
+            if not self.speaking:
+                self.speaking = True
+                return True
+        elif self.speaking:
+            self.quiet += len(pcm) / RATE
+            if self.quiet >= self.silence:
+                self.speaking = False
+                return False
+        return None
+
+
+class ASRWorker:
+    """
+    运行在子进程中的ASR客户端
+    """
+    def __init__(self, conn, config: dict):
+        self.conn = conn
+        self.client = FunASRClient(config)
+        self.max_backoff = config.get("reconnect", 10)
+        self.vad = EnergyVAD(config.get("vad_threshold", 500), config.get("vad_silence", 0.3))
+
+        self.stopped = False
+        self.generation = 0
+        # reset后丢弃上一句的最终结果，直到收到is_final或超时
+        self.draining_until = 0.0
+        self.transcript = Transcript()
+
+
+    def start_threads(self, loop: asyncio.AbstractEventLoop):
+        """
+        启动读取麦克风和控制命令的线程，两者都是阻塞调用
+        """
+        import pyaudio
+
+        audio = pyaudio.PyAudio()
+        stream = audio.open(format=pyaudio.paInt16, channels=1, rate=RATE, input=True, frames_per_buffer=self.client.chunk_frames)
+
+        def put_audio(data: bytes):
+            if self.audio.qsize() >= MAX_PENDING_CHUNKS:
+                self.audio.get_nowait()
+            self.audio.put_nowait(data)
+
+        def record():
+            while not self.stopped:
+                data = stream.read(self.client.chunk_frames, exception_on_overflow=False)
+                loop.call_soon_threadsafe(put_audio, data)
+            stream.close()
+            audio.terminate()
+
+        def control():
+            while not self.stopped:
+                try:
+                    command = self.conn.recv()
+                except (EOFError, OSError):
+                    command = ("stop",)
+                if command[0] == "stop":
+                    self.stopped = True
+                loop.call_soon_threadsafe(self.commands.put_nowait, command)
+
+        threading.Thread(target=record, name="asr-microphone", daemon=True).start()
+        threading.Thread(target=control, name="asr-control", daemon=True).start()
+
+
+    async def send_audio(self, websocket):
+        while True:
+            data = await self.audio.get()
+            speaking = self.vad.update(data)
+            if speaking is not None:
+                self.conn.send((self.generation, ASRResult(self.transcript.text, speaking=speaking)))
+            await websocket.send(data)
+
+
+    async def receive(self, websocket):
+        """
+        接收识别结果，2pass模式下离线结果替换对应的在线结果
+        """
+        async for message in websocket:
+            result = json.loads(message)
+            text = result.get("text", "")
+            mode = result.get("mode")
+            if mode is None:
+                continue
+            if self.draining_until:
+                final = result.get("is_final", False)
+                if not final and time.monotonic() < self.draining_until:
+                    continue
+                self.draining_until = 0.0
+                if final:
+                    continue
+            text = self.transcript.update(mode, text)
+            self.conn.send((self.generation, ASRResult(text, mode, result.get("is_final", False))))
+
+
+    async def handle_commands(self, websocket):
+        while True:
+            command, *args = await self.commands.get()
+            if command == "stop":
+                return
+            if command == "reset":
+                self.generation = args[0]
+                self.transcript.clear()
+                # 结束当前语句并开始新的语句，服务端的识别状态随之清空
+                await websocket.send(self.client.end_message())
+                await websocket.send(self.client.start_message())
+                self.draining_until = time.monotonic() + 1.0
+
+
+    async def session(self, websocket):
+        """
+        在一个websocket连接上收发数据，任一环节出错时返回以便重连
+        """
+        while not self.audio.empty():
+            self.audio.get_nowait()
+        await websocket.send(self.client.start_message())
+
+        tasks = [
+            asyncio.create_task(self.send_audio(websocket)),
+            asyncio.create_task(self.receive(websocket)),
+            asyncio.create_task(self.handle_commands(websocket)),
+        ]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+            if not self.stopped:
+                raise ConnectionError("Connection closed by server")
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.audio: asyncio.Queue = asyncio.Queue()
+        self.commands: asyncio.Queue = asyncio.Queue()
+        self.start_threads(loop)
+
+        backoff = 0.5
+        while not self.stopped:
+            try:
+                async with await self.client.connect() as websocket:
+                    logging.info(f"ASR worker connected to {self.client.uri}")
+                    backoff = 0.5
+                    self.draining_until = 0.0
+                    self.transcript.clear()
+                    await self.session(websocket)
+            except Exception as e:
+                if self.stopped:
+                    break
+                logging.warning(f"ASR connection lost, reconnecting in {backoff:.1f}s: {e!r}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+
+def asr_worker(conn, config: dict):
+    """
+    工作进程入口
+    """
+    asyncio.run(ASRWorker(conn, config).run())
+
+
+class ASRProcess:
+    """
+    主进程中的ASR工作进程句柄
+
+    每次reset都会增加一个代数，工作进程返回的结果带有产生时的代数，
+    reset之前产生但尚未读取的结果会被丢弃。
+    识别结果在管道可读时由事件循环直接放入异步队列，不需要轮询管道。
+    """
+    def __init__(self):
+        self.process: Process | None = None
+        self.conn = None
+        self.generation = 0
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.reader: int | None = None
+        self.results: asyncio.Queue = asyncio.Queue()
+
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+
+    def start(self):
+        """
+        启动工作进程，已经在运行时不做任何事，进程意外退出时重新启动
+        """
+        if self.alive:
+            return
+        if self.process is not None:
+            logging.warning(f"ASR worker exited with code {self.process.exitcode}, restarting")
+            self.close()
+
+        start_time = time.time()
+        self.conn, child_conn = Pipe()
+        worker_config = {
+            **config,
+            "vad_threshold": asr_config.get("vad_threshold", 500),
+            "vad_silence": asr_config.get("vad_silence", 0.3),
+        }
+        self.process = Process(target=asr_worker, args=(child_conn, worker_config), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.attach()
+        logging.info(f"ASR worker started: {time.time() - start_time:.2f}s")
+
+
+    def attach(self):
+        """
+        把结果管道接入事件循环
+
+        selector事件循环通过add_reader在管道可读时回调；Windows默认的Proactor
+        事件循环不支持add_reader，改用后台线程阻塞读取后转交给事件循环。
+        """
+        self.loop = asyncio.get_running_loop()
+        self.results = asyncio.Queue()
+        try:
+            self.loop.add_reader(self.conn.fileno(), self.on_readable, self.conn, self.results)
+            self.reader = self.conn.fileno()
+        except (NotImplementedError, ValueError, OSError):
+            threading.Thread(
+                target=self.read_forever,
+                args=(self.conn, self.loop, self.results),
+                name="asr-results",
+                daemon=True,
+            ).start()
+
+
+    def detach(self):
+        if self.reader is not None:
+            self.loop.remove_reader(self.reader)
+            self.reader = None
+
+
+    def on_readable(self, conn, results: asyncio.Queue):
+        try:
+            while conn.poll():
+                results.put_nowait(conn.recv())
+        except (EOFError, OSError) as e:
+            self.detach()
+            results.put_nowait(e)
+
+
+    @staticmethod
+    def read_forever(conn, loop: asyncio.AbstractEventLoop, results: asyncio.Queue):
+        while True:
+            try:
+                item = conn.recv()
+            except (EOFError, OSError) as e:
+                loop.call_soon_threadsafe(results.put_nowait, e)
+                return
+            loop.call_soon_threadsafe(results.put_nowait, item)
+
+
+    def send(self, *command):
+        try:
+            self.conn.send(command)
+        except (OSError, AttributeError) as e:
+            logging.error(f"Failed to send ASR command {command[0]}: {e}")
+
+
+    def reset(self):
+        """
+        开始新的一句话，丢弃之前的识别结果
+        """
+        self.generation += 1
+        self.send("reset", self.generation)
+
+
+    async def get(self) -> ASRResult:
+        """
+        等待当前语句的下一条识别结果或VAD事件，过期的结果会被跳过
+
+        Returns:
+            ASRResult: 识别事件
+
+        Raises:
+            EOFError: 工作进程已经退出
+        """
+        while True:
+            item = await self.results.get()
+            if isinstance(item, Exception):
+                raise EOFError(f"ASR worker exited: {item!r}")
+            generation, result = item
+            if generation == self.generation:
+                return result
+
+
+    async def get_text(self) -> str:
+        """
+        等待当前语句的下一条识别文本，忽略VAD事件
+        """
+        while True:
+            result = await self.get()
+            if result.speaking is None:
+                return result.text
+
+
+    def close(self):
+        """
+        释放工作进程和管道，进程仍在运行时直接终止
+        """
+        self.detach()
+        if self.process is not None:
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process = None
+        if self.conn is not None:
+            # 工作进程退出后再关闭管道，读取线程随之收到EOF退出
+            self.conn.close()
+            self.conn = None
+
+
+    async def stop(self, timeout: float = 1.0):
+        """
+        通知工作进程退出，等待期间不阻塞事件循环，超时后终止进程
+        """
+        self.detach()
+        if self.conn is not None:
+            self.send("stop")
+        deadline = time.monotonic() + timeout
+        while self.alive and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        self.close()
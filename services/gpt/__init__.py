@@ -24,3 +24,13 @@ def GPT():
             return Qwen()
         else:
             raise ValueError(f"Invalid GPT type: {mode}")
+
+
+def get_rag_index():
+    """
+    获取RAG索引，未启用RAG时返回None
+    """
+    if not rag_enable:
+        return None
+    from .rag import rag_index
+    return rag_index
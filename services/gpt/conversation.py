@@ -0,0 +1,155 @@
+"""
+对话历史存储模块
+
+按会话ID保存对话历史，支持两种后端：
+- memory: 进程内存储，按最近最少使用顺序和过期时间淘汰
+- disk: 在内存存储的基础上将每个会话持久化为JSON文件，重启后可恢复
+
+消息历史以元组形式保存，追加消息时生成新元组而不修改旧数据，
+构造请求体时只需浅拷贝即可安全共享。
+
+作者: 光明实验室媒体智能团队
+"""
+
+import os
+import json
+import time
+import hashlib
+from dataclasses import dataclass, field
+from collections import OrderedDict
+
+from utils import Config, get_logger
+
+logging = get_logger()
+home_dir = os.getcwd()
+config = Config.get("Session", {}) or {}
+
+
+@dataclass
+class Conversation:
+    """
+    单个会话的对话状态
+
+    Attributes:
+        messages: 已发送给模型的消息历史
+        assistant_message: 当前轮次正在生成的助手回复，下一轮请求时写入历史
+        updated_at: 最近一次更新的时间戳
+    """
+    messages: tuple[dict, ...] = ()
+    assistant_message: str = ""
+    updated_at: float = field(default_factory=time.time)
+
+
+class MemoryStore:
+    def __init__(self, max_sessions: int = 256, ttl: float = 86400):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.conversations: OrderedDict[str, Conversation] = OrderedDict()
+
+
+    def expired(self, conversation: Conversation) -> bool:
+        return bool(self.ttl) and time.time() - conversation.updated_at > self.ttl
+
+
+    def load(self, session_id: str) -> Conversation | None:
+        return None
+
+
+    def get(self, session_id: str) -> Conversation:
+        """
+        获取会话的对话状态，不存在或已过期时返回新的空会话
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            Conversation: 会话的对话状态
+        """
+        conversation = self.conversations.get(session_id)
+        if conversation is None:
+            conversation = self.load(session_id)
+
+        if conversation is None or self.expired(conversation):
+            conversation = Conversation()
+
+        self.conversations[session_id] = conversation
+        self.conversations.move_to_end(session_id)
+        while len(self.conversations) > self.max_sessions:
+            evicted, _ = self.conversations.popitem(last=False)
+            logging.info(f"Conversation evicted: {evicted}")
+
+        return conversation
+
+
+    def save(self, session_id: str, conversation: Conversation):
+        conversation.updated_at = time.time()
+        self.conversations[session_id] = conversation
+
+
+    def reset(self, session_id: str):
+        self.conversations.pop(session_id, None)
+
+
+class DiskStore(MemoryStore):
+    def __init__(self, path: str, max_sessions: int = 256, ttl: float = 86400):
+        super().__init__(max_sessions, ttl)
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+
+    def filename(self, session_id: str) -> str:
+        name = hashlib.sha1(session_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.path, f"{name}.json")
+
+
+    def load(self, session_id: str) -> Conversation | None:
+        filename = self.filename(session_id)
+        if not os.path.exists(filename):
+            return None
+        try:
+            with open(filename, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+            return Conversation(
+                messages=tuple(data.get("messages", [])),
+                assistant_message=data.get("assistant_message", ""),
+                updated_at=data.get("updated_at", 0),
+            )
+        except (OSError, json.JSONDecodeError) as e:
+            logging.error(f"Failed to load conversation {session_id}: {e}")
+            return None
+
+
+    def save(self, session_id: str, conversation: Conversation):
+        super().save(session_id, conversation)
+        try:
+            with open(self.filename(session_id), 'w', encoding='utf-8') as file:
+                json.dump({
+                    "session_id": session_id,
+                    "messages": conversation.messages,
+                    "assistant_message": conversation.assistant_message,
+                    "updated_at": conversation.updated_at,
+                }, file, ensure_ascii=False)
+        except OSError as e:
+            logging.error(f"Failed to save conversation {session_id}: {e}")
+
+
+    def reset(self, session_id: str):
+        super().reset(session_id)
+        try:
+            os.remove(self.filename(session_id))
+        except FileNotFoundError:
+            pass
+
+
+def ConversationStore():
+    store = config.get("store", "memory")
+    max_sessions = config.get("store_max_sessions", 256)
+    ttl = config.get("history_ttl", 86400)
+    if store == "memory":
+        return MemoryStore(max_sessions, ttl)
+    elif store == "disk":
+        path = os.path.join(home_dir, config.get("store_dir", "sessions"))
+        return DiskStore(path, max_sessions, ttl)
+    else:
+        raise ValueError(f"Invalid conversation store: {store}")
@@ -0,0 +1,166 @@
+"""
+对话历史窗口模块
+
+按token预算裁剪发送给模型的消息历史：始终保留系统提示词和本轮用户消息，
+再从最近的对话开始向前保留尽可能多的完整轮次。被裁剪的早期对话可以选择
+压缩为一段摘要，以系统消息的形式附加在提示词之后。
+
+作者: 光明实验室媒体智能团队
+"""
+
+from functools import lru_cache
+from typing import Callable
+
+from utils import get_logger
+
+logging = get_logger()
+
+
+def get_counter(name: str = "tiktoken", encoding: str = "cl100k_base") -> Callable[[str], int]:
+    """
+    获取token计数函数
+
+    Args:
+        name: 计数方式，tiktoken使用BPE编码计数，char按字符数计数
+        encoding: tiktoken使用的编码名称
+
+    Returns:
+        Callable[[str], int]: 计算文本token数的函数
+    """
+    if name == "tiktoken":
+        try:
+            import tiktoken
+            encoder = tiktoken.get_encoding(encoding)
+        except Exception as e:
+            logging.warning(f"Failed to load tiktoken encoding {encoding}, counting characters instead: {e}")
+        else:
+            return lambda text: len(encoder.encode(text, disallowed_special=()))
+    elif name != "char":
+        raise ValueError(f"Invalid token counter: {name}")
+    return len
+
+
+class HistoryWindow:
+    # 每条消息除内容外的固定开销（角色、分隔符等）
+    MESSAGE_OVERHEAD = 4
+
+    def __init__(
+        self,
+        max_tokens: int = 4096,
+        counter: Callable[[str], int] = len,
+        summary: bool = False,
+        summary_tokens: int = 256,
+    ):
+        self.max_tokens = max_tokens
+        self.summary = summary
+        self.summary_tokens = summary_tokens
+        self.count = lru_cache(maxsize=4096)(counter)
+
+
+    def message_tokens(self, message: dict) -> int:
+        return self.count(message.get("content") or "") + self.MESSAGE_OVERHEAD
+
+
+    def summarize(self, messages: tuple[dict, ...]) -> dict | None:
+        """
+        将被裁剪的对话压缩为摘要
+
+        从最近的被裁剪轮次开始向前摘录用户问题和助手回复的开头，直到摘要预算用完，
+        超出剩余预算的摘录会被截短。
+
+        Args:
+            messages: 被裁剪的消息
+
+        Returns:
+            dict | None: 摘要系统消息，预算内放不下任何摘录时返回None
+        """
+        header = "以下是较早对话的摘要："
+        lines = []
+        budget = self.summary_tokens - self.count(header) - self.MESSAGE_OVERHEAD
+        for message in reversed(messages):
+            if budget <= 0:
+                break
+            content = (message.get("content") or "").strip()
+            if not content:
+                continue
+            role = "用户" if message["role"] == "user" else "助手"
+            excerpt = content.splitlines()[0][:80]
+            line = f"\n{role}: {excerpt}"
+            tokens = self.count(line)
+            # 放不下整条摘录时按比例截短，直到符合剩余预算
+            while tokens > budget and excerpt:
+                excerpt = excerpt[:len(excerpt) * budget // tokens]
+                line = f"\n{role}: {excerpt}"
+                tokens = self.count(line)
+            if not excerpt:
+                break
+            budget -= tokens
+            lines.append(line)
+
+        if not lines:
+            return None
+        return {
+            "role": "system",
+            "content": header + "".join(reversed(lines))
+        }
+
+
+    def fit(self, history: tuple[dict, ...], budget: int) -> int:
+        """
+        计算在预算内能保留的最早消息位置
+
+        本轮用户消息总是保留，其余消息从后向前按完整轮次保留。
+
+        Returns:
+            int: 保留部分的起始下标
+        """
+        cut = len(history) - 1
+        used = self.message_tokens(history[cut])
+        index = cut - 1
+        while index >= 0:
+            used += self.message_tokens(history[index])
+            if used > budget:
+                break
+            if history[index]["role"] == "user":
+                cut = index
+            index -= 1
+        return cut
+
+
+    def window(self, messages: tuple[dict, ...]) -> tuple[dict, ...]:
+        """
+        按token预算截取消息历史
+
+        Args:
+            messages: 完整的消息历史，最后一条为本轮用户消息
+
+        Returns:
+            tuple[dict, ...]: 裁剪后的消息历史
+        """
+        if not messages:
+            return messages
+
+        system = messages[:1] if messages[0]["role"] == "system" else ()
+        history = messages[len(system):]
+        if not history:
+            return messages
+
+        budget = self.max_tokens - sum(self.message_tokens(m) for m in system)
+        cut = self.fit(history, budget)
+        if cut > 0 and self.summary:
+            # 确实需要裁剪时才为摘要预留预算
+            cut = self.fit(history, budget - self.summary_tokens)
+
+        evicted, kept = history[:cut], history[cut:]
+        if evicted and self.summary:
+            summary = self.summarize(evicted)
+            if summary is not None:
+                system += (summary,)
+
+        messages = system + kept
+        logging.info(
+            f"Request size: {len(messages)} messages, about {sum(self.message_tokens(m) for m in messages)} tokens"
+            f" ({len(evicted)} of {len(history)} history messages evicted)"
+        )
+
+        return messages
@@ -0,0 +1,221 @@
+"""
+向量批量计算模块
+
+把待索引的文本按token数分批，以可配置的并发数请求嵌入服务，失败的批次按指数退避重试。
+每个完成的批次立即写入检查点文件，中断或失败后重新运行时只计算剩余的文本。
+
+作者: 光明实验室媒体智能团队
+"""
+
+import os
+import json
+import time
+import asyncio
+from typing import Callable, List
+
+from langchain_core.embeddings import Embeddings
+
+from utils import get_logger
+
+logging = get_logger()
+
+
+def make_batches(items: list[tuple[str, str]], count: Callable[[str], int], max_tokens: int, max_size: int) -> list[list[tuple[str, str]]]:
+    """
+    按token数分批
+
+    Args:
+        items: (ID, 文本)列表
+        count: token计数函数
+        max_tokens: 每批的token上限，单条超过上限的文本单独成批
+        max_size: 每批的最大条数
+
+    Returns:
+        list[list[tuple[str, str]]]: 分好的批次
+    """
+    batches = []
+    batch = []
+    tokens = 0
+    for item in items:
+        size = count(item[1])
+        if batch and (tokens + size > max_tokens or len(batch) >= max_size):
+            batches.append(batch)
+            batch = []
+            tokens = 0
+        batch.append(item)
+        tokens += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class Checkpoint:
+    """
+    已完成向量的检查点文件
+
+    JSON Lines格式，第一行记录嵌入模型名称，之后每行为一条文本的ID和向量。
+    模型名称不一致的检查点会被丢弃。
+    """
+    def __init__(self, path: str | None, model: str):
+        self.path = path
+        self.model = model
+        self.file = None
+
+
+    def load(self) -> dict[str, List[float]]:
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        vectors = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                header = json.loads(file.readline() or "{}")
+                if header.get("model") != self.model:
+                    logging.info(f"Discarding embedding checkpoint for model {header.get('model')}")
+                    return {}
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 中断时写了一半的最后一行
+                        break
+                    vectors[record["id"]] = record["vector"]
+        except Exception as e:
+            logging.warning(f"Failed to read embedding checkpoint {self.path}: {e}")
+            return {}
+        return vectors
+
+
+    def open(self, vectors: dict[str, List[float]]):
+        """
+        重写检查点文件，只保留仍然需要的向量，之后追加新的结果
+        """
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.file = open(self.path, 'w', encoding='utf-8')
+        self.file.write(json.dumps({"model": self.model}) + "\n")
+        self.append(vectors)
+
+
+    def append(self, vectors: dict[str, List[float]]):
+        if self.file is None:
+            return
+        for id, vector in vectors.items():
+            self.file.write(json.dumps({"id": id, "vector": vector}) + "\n")
+        self.file.flush()
+
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+    def remove(self):
+        self.close()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class EmbeddingIngestor:
+    """
+    并发、可重试、可断点续算的向量批量计算
+
+    Args:
+        embedding: 嵌入模型
+        model: 嵌入模型名称，用于校验检查点
+        count: token计数函数
+        batch_tokens: 每批的token上限
+        batch_size: 每批的最大条数
+        concurrency: 同时进行的嵌入请求数
+        retries: 每批失败后的重试次数
+        backoff: 第一次重试前的等待时间（秒），之后逐次加倍
+        checkpoint: 检查点文件路径，为空时不保存检查点
+    """
+    def __init__(
+        self,
+        embedding: Embeddings,
+        model: str = "",
+        count: Callable[[str], int] = len,
+        batch_tokens: int = 8192,
+        batch_size: int = 64,
+        concurrency: int = 4,
+        retries: int = 3,
+        backoff: float = 1.0,
+        checkpoint: str | None = None,
+    ):
+        self.embedding = embedding
+        self.count = count
+        self.batch_tokens = batch_tokens
+        self.batch_size = max(batch_size, 1)
+        self.concurrency = max(concurrency, 1)
+        self.retries = retries
+        self.backoff = backoff
+        self.checkpoint = Checkpoint(checkpoint, model)
+
+
+    async def embed_batch(self, batch: list[tuple[str, str]]) -> dict[str, List[float]]:
+        texts = [text for _, text in batch]
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                vectors = await self.embedding.aembed_documents(texts)
+                return {id: vector for (id, _), vector in zip(batch, vectors)}
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                logging.warning(f"Embedding batch of {len(batch)} failed, retrying in {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+                delay *= 2
+
+
+    async def embed(self, items: list[tuple[str, str]]) -> dict[str, List[float]]:
+        """
+        计算所有文本的向量
+
+        Args:
+            items: (ID, 文本)列表
+
+        Returns:
+            dict[str, List[float]]: ID到向量的映射
+
+        Raises:
+            Exception: 有批次在重试后仍然失败时抛出，已完成的批次保留在检查点中
+        """
+        ids = {id for id, _ in items}
+        vectors = {id: vector for id, vector in self.checkpoint.load().items() if id in ids}
+        pending = [item for item in items if item[0] not in vectors]
+        if vectors:
+            logging.info(f"Resuming embedding from checkpoint: {len(vectors)} done, {len(pending)} remaining")
+        if not pending:
+            return vectors
+
+        batches = make_batches(pending, self.count, self.batch_tokens, self.batch_size)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        start_time = time.time()
+        done = 0
+
+        async def run(batch):
+            nonlocal done
+            async with semaphore:
+                result = await self.embed_batch(batch)
+            vectors.update(result)
+            self.checkpoint.append(result)
+            done += len(batch)
+            elapsed = time.time() - start_time
+            logging.info(f"Embedded {done}/{len(pending)} documents, {done / elapsed if elapsed else 0:.1f} docs/s")
+
+        logging.info(f"Embedding {len(pending)} documents in {len(batches)} batches, concurrency {self.concurrency}")
+        self.checkpoint.open(vectors)
+        try:
+            results = await asyncio.gather(*(run(batch) for batch in batches), return_exceptions=True)
+        finally:
+            self.checkpoint.close()
+
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            raise RuntimeError(f"{len(errors)} of {len(batches)} embedding batches failed: {errors[0]}") from errors[0]
+
+        elapsed = time.time() - start_time
+        logging.info(f"Embedded {len(pending)} documents in {elapsed:.2f} seconds, {len(pending) / elapsed if elapsed else 0:.1f} docs/s")
+        return vectors
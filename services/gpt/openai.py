@@ -1,9 +1,11 @@
-import copy
-import json
 import time
 import os
 import yaml
-from utils import httpx_client, Config, get_logger, Prompt
+import orjson
+from dataclasses import dataclass, replace
+from utils import httpx_client, Config, get_logger, Prompt, aiter_sse
+from .conversation import ConversationStore, Conversation
+from .history import HistoryWindow, get_counter
 
 logging = get_logger()
 home_dir = os.getcwd()
@@ -15,55 +17,134 @@ if per_config is not None:
         config = yaml.safe_load(file)
 
 
+@dataclass(slots=True)
+class Delta:
+    """
+    模型流式响应中的一个增量事件
+    
+    Attributes:
+        content: 本次增量的文本内容
+        finish_reason: 结束原因，未结束时为None
+        data: 事件的原始JSON数据
+        payload: 解析后的JSON对象
+    """
+    content: str
+    finish_reason: str | None
+    data: bytes
+    payload: dict
+
+
 class OpenAI:
     def __init__(self):
         self.api_endpoint = config.get("api_endpoint", "https://api.openai.com/v1/chat/completions")
         self.headers = config.get("request_header", {
             "Content-Type": "application/json; charset=UTF-8"
         })
-        self.reset_body()
+        # 请求体模板只读共享，每轮请求仅浅拷贝并替换消息列表
+        self.body = config.get("request_body", {
+            "model": "gpt-4",
+            "messages": [],
+            "temperature": 0.7,
+            "top_p": 1,
+            "n": 1,
+            "stream": True,
+            "max_tokens": 10000,
+        })
         
         self.prompt = Prompt
-            
-        self.assistant_message = ""
+        
+        self.store = ConversationStore()
+        
+        history_config = config.get("history", {}) or {}
+        self.history = HistoryWindow(
+            max_tokens=history_config.get("max_tokens", 4096),
+            counter=get_counter(
+                history_config.get("counter", "tiktoken"),
+                history_config.get("encoding", "cl100k_base")
+            ),
+            summary=history_config.get("summary", False),
+            summary_tokens=history_config.get("summary_tokens", 256),
+        )
         
     
-    def set_body(self, message: str) -> dict:
-        messages = self.body.get("messages", [])
+    def build_messages(self, conversation: Conversation, message: str) -> tuple[dict, ...]:
+        """
+        在会话历史后追加本轮消息
+        
+        首轮对话以系统提示词开头；之后先写入上一轮的助手回复，再写入用户消息。
+        返回新的元组，不修改原有历史。
+        """
+        messages = conversation.messages
         
-        if self.body is None:
-            messages.append({
+        if not messages:
+            messages = ({
                 "role": "system",
                 "content": self.prompt
-            })
-            messages.append({
-                "role": "user",
-                "content": message
-            })
-        else:
-            messages.append({
+            },)
+        elif messages[-1]["role"] == "user":
+            messages += ({
                 "role": "assistant",
-                "content": self.assistant_message
-            })
-            messages.append({
-                "role": "user",
-                "content": message
-            })
-            self.assistant_message = ""
+                "content": conversation.assistant_message
+            },)
             
-        self.body["messages"] = messages
+        return messages + ({
+            "role": "user",
+            "content": message
+        },)
+    
+    
+    def make_body(self, messages: tuple[dict, ...]) -> dict:
+        body = dict(self.body)
+        body["messages"] = list(messages)
+        return body
+    
+    
+    def set_body(self, message: str, session_id: str) -> dict:
+        conversation = self.store.get(session_id)
+        conversation.messages = self.build_messages(conversation, message)
+        conversation.assistant_message = ""
+        self.store.save(session_id, conversation)
+        
+        return self.make_body(self.history.window(conversation.messages))
+    
+    
+    def snapshot(self, session_id: str) -> Conversation:
+        """
+        记录会话当前的对话状态，用于撤销之后的一轮对话
+        """
+        return replace(self.store.get(session_id))
+    
+    
+    def restore(self, session_id: str, snapshot: Conversation):
+        """
+        把会话恢复到snapshot记录的状态，丢弃之后写入的用户消息和助手回复
+        """
+        conversation = self.store.get(session_id)
+        conversation.messages = snapshot.messages
+        conversation.assistant_message = snapshot.assistant_message
+        self.store.save(session_id, conversation)
+    
+    
+    async def prepare(self, message: str, session_id: str) -> str:
+        """
+        发送请求前处理用户消息的异步钩子，子类可以在这里完成检索等耗时操作
         
-        return self.body
+        Returns:
+            str: 写入对话历史并发送给模型的消息
+        """
+        return message
     
     
-    async def generate_stream(self, message: str):
+    async def generate_stream(self, message: str, session_id: str):
         try:
             start_time = time.time()
+            
+            message = await self.prepare(message, session_id)
                 
             async with httpx_client.stream(
                 "POST",
                 self.api_endpoint,
-                json=self.set_body(message),
+                json=self.set_body(message, session_id),
                 headers=self.headers,
             ) as response:
                 first_repsonse_time = time.time()
@@ -88,65 +169,97 @@ class OpenAI:
             raise Exception(f"Failed to request GPT service: {e}")
 
 
-    def get_response_content(self, response) -> str:
-        try:
-            json_data = json.loads(response)
-            content = json_data['choices'][0]['delta'].get('content', '')
-            return content
+    def make_chunk(self, content: str, finish_reason: str | None = None) -> bytes:
+        """
+        构造一个与模型响应格式相同的SSE事件，用于不经过模型的回答
+        """
+        return b"data: " + orjson.dumps({
+            "id": "chatcmpl-local",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": self.body.get("model", ""),
+            "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": finish_reason}]
+        }) + b"\n\n"
+
+
+    def parse_delta(self, data: bytes, payload: dict) -> Delta:
+        choice = (payload.get('choices') or [{}])[0]
+        return Delta(
+            content=(choice.get('delta') or {}).get('content') or '',
+            finish_reason=choice.get('finish_reason'),
+            data=data,
+            payload=payload,
+        )
+
+
+    async def delta_stream(self, gpt_stream):
+        """
+        将模型响应字节流解析为增量事件流
         
-        except json.JSONDecodeError:
-            logging.error(f"Failed to parse JSON data: {response}")
-            return ""
+        每个SSE事件只解析一次，解析结果由下游的文本流、输出流和日志统计共享。
         
-
-    async def create_text_stream(self, gpt_stream):
-        buffer = b""
-        split_bytes = b""
-        async for chunk in gpt_stream:
-            if chunk is None:
-                break
-            buffer += chunk
+        Args:
+            gpt_stream: 模型响应的字节流
             
-            if b"\r\n\r\n" in buffer:
-                split_bytes = b"\r\n\r\n"
-            elif b"\n\n" in buffer:
-                split_bytes = b"\n\n"
-            else:
+        Yields:
+            Delta: 解析后的增量事件
+        """
+        async for data in aiter_sse(gpt_stream):
+            try:
+                payload = orjson.loads(data)
+            except orjson.JSONDecodeError:
+                logging.error(f"Failed to parse JSON data: {data}")
                 continue
-                
-            while split_bytes in buffer:
-                line: bytes
-                line, buffer = buffer.split(split_bytes, 1)
-                text = line.decode("utf-8")
-                
-                if "data:" in text:
-                    text = text.split("data:")[1].strip()
-                    if text == "[DONE]":
-                        yield None
-                        break
-                    
-                    content = self.get_response_content(text)
-                    if content:
-                        yield content
-                        self.assistant_message += content
+            yield self.parse_delta(data, payload)
+        
+
+    async def create_text_stream(self, delta_stream, session_id: str):
+        conversation = self.store.get(session_id)
+        delta: Delta
+        async for delta in delta_stream:
+            if delta.content:
+                yield delta.content
+                conversation.assistant_message += delta.content
+        
+        self.store.save(session_id, conversation)
+        yield None
 
 
     @staticmethod
-    async def output_stream(gpt_stream):
-        chunk: bytes
-        async for chunk in gpt_stream:
-            if chunk is None:
-                break
-            yield chunk
+    async def output_stream(delta_stream):
+        delta: Delta
+        async for delta in delta_stream:
+            yield b"data: " + delta.data + b"\n\n"
+        yield b"data: [DONE]\n\n"
+        
+        
+    @staticmethod
+    async def log_stream(delta_stream, start_time: float):
+        """
+        统计模型输出的首字时间和生成速度
+        """
+        first_time = None
+        count = 0
+        length = 0
+        delta: Delta
+        try:
+            async for delta in delta_stream:
+                if not delta.content:
+                    continue
+                if first_time is None:
+                    first_time = time.time()
+                    logging.info(f"First token time: {first_time - start_time:.2f}s")
+                count += 1
+                length += len(delta.content)
+        except Exception as e:
+            # 上游错误由输出流返回给调用方，这里只记录，避免任务异常无人读取
+            logging.warning(f"Model stream failed after {count} deltas: {e}")
+            return
+        
+        if first_time is not None:
+            elapsed = time.time() - first_time
+            logging.info(f"Generated {length} characters in {count} deltas, {length / elapsed if elapsed else 0:.1f} chars/s")
             
     
-    def reset_body(self):
-        self.body = copy.deepcopy(config.get("request_body", {
-            "model": "gpt-4",
-            "messages": [],
-            "temperature": 0.7,
-            "top_p": 1,
-            "n": 1,
-            "stream": True,
-            "max_tokens": 10000,
-        }))
+    def reset_body(self, session_id: str):
+        self.store.reset(session_id)
@@ -1,93 +1,56 @@
-from .openai import OpenAI
+from .openai import OpenAI, Delta
 import time
-import json
+import orjson
 from utils import get_logger
 
 logging = get_logger()
 
 
 class Qwen(OpenAI):
-    def set_body(self, message: str) -> dict:
-        messages = self.body.get("input", {}).get("messages", [])
-        
-        if self.body is None:
-            messages.append({
-                "role": "system",
-                "content": self.prompt
-            })
-            messages.append({
-                "role": "user",
-                "content": message
-            })
-        else:
-            messages.append({
-                "role": "assistant",
-                "content": self.assistant_message
-            })
-            messages.append({
-                "role": "user",
-                "content": message
-            })
-            self.assistant_message = ""
-            
-        self.body["input"]["messages"] = messages
-        
-        return self.body
+    def make_body(self, messages: tuple[dict, ...]) -> dict:
+        body = dict(self.body)
+        body["input"] = {**self.body.get("input", {}), "messages": list(messages)}
+        return body
     
     
-    def get_response_content(self, response) -> str:
-        try:
-            json_data = json.loads(response)
-            content = json_data['output'].get('text', '')
-            return content
-        
-        except json.JSONDecodeError:
-            logging.error(f"Failed to parse JSON data: {response}")
-            return ""
+    def make_chunk(self, content: str, finish_reason: str | None = None) -> bytes:
+        return b"data: " + orjson.dumps({
+            "output": {"text": content, "finish_reason": finish_reason or "null"},
+            "request_id": "local",
+        }) + b"\n\n"
+    
+    
+    def parse_delta(self, data: bytes, payload: dict) -> Delta:
+        output = payload.get('output') or {}
+        finish_reason = output.get('finish_reason')
+        return Delta(
+            content=output.get('text') or '',
+            finish_reason=None if finish_reason in (None, 'null') else finish_reason,
+            data=data,
+            payload=payload,
+        )
                     
                     
     @staticmethod
-    async def output_stream(gpt_stream):
-        buffer = b""
-        async for chunk in gpt_stream:
-            if chunk is None:
-                break
-            buffer += chunk
-            if b"\r\n\r\n" in buffer:
-                split_bytes = b"\r\n\r\n"
-            elif b"\n\n" in buffer:
-                split_bytes = b"\n\n"
-            else:
-                continue
-            
-            while split_bytes in buffer:
-                line, buffer = buffer.split(split_bytes, 1)
-                text = line.decode("utf-8")
-                if "data:" in text:
-                    text = text.split("data:")[1].strip()
-                    if text == "[DONE]":
-                        yield text + "\n\n"
-                        break
-                    
-                    try:
-                        json_data: dict = json.loads(text.strip())
-                        yield "data: " + json.dumps({
-                            "id": "chat" + json_data.get('request_id', ''),
-                            "model": json_data['usage']['models'][0].get('model_id', ''),
-                            "create": int(time.time()),
-                            "object": "chat.completion.chunk",
-                            "choices": [
-                                {
-                                    "index": 0,
-                                    "delta": {
-                                        "content": json_data['output'].get('text', '')
-                                    },
-                                    "finish_reason": json_data['output'].get('finish_reason', '')
-                                }
-                            ]
-                        }) + "\n\n"
-                        
-                    except json.JSONDecodeError as e:
-                        logging.error(f"Failed to parse JSON data: {e}")
-                        raise
-                    
+    async def output_stream(delta_stream):
+        delta: Delta
+        async for delta in delta_stream:
+            payload = delta.payload
+            models = (payload.get('usage') or {}).get('models') or [{}]
+            yield b"data: " + orjson.dumps({
+                "id": "chat" + payload.get('request_id', ''),
+                "model": models[0].get('model_id', ''),
+                "create": int(time.time()),
+                "object": "chat.completion.chunk",
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {
+                            "content": delta.content
+                        },
+                        "finish_reason": delta.finish_reason
+                    }
+                ]
+            }) + b"\n\n"
+        
+        yield b"data: [DONE]\n\n"
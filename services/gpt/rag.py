@@ -1,15 +1,24 @@
 from .openai import OpenAI
 from .qwen import Qwen
+from .history import get_counter
+from .ingest import EmbeddingIngestor
 from utils import Config, get_logger, Template
 from typing import List
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_community.vectorstores import FAISS
 from langchain_openai import OpenAIEmbeddings
+from collections import OrderedDict
 import os
+import re
 import json
 import copy
 import time
+import hashlib
 import yaml
+import asyncio
+import unicodedata
+import numpy as np
 
 home_dir = os.getcwd()
 logging = get_logger()
@@ -21,15 +30,93 @@ if per_config is not None:
         config = yaml.safe_load(file)
 config = config.get("RAG", {})
 
+top_k = config.get("top_k", 3)
+index_dir = os.path.join(home_dir, config.get("index_dir", "rag_index"))
+MANIFEST = "manifest.json"
+CHECKPOINT = "checkpoint.jsonl"
+ingest_config = config.get("ingest", {}) or {}
+faq_config = config.get("faq", {}) or {}
+
+
+def normalize_query(text: str) -> str:
+    """
+    归一化问题文本：全角转半角、小写、合并空白并去掉句尾标点
+    """
+    text = unicodedata.normalize("NFKC", text).strip().lower()
+    text = re.sub(r"\s+", " ", text)
+    return text.rstrip("?!.,~。，！？～ ")
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    带查询向量LRU缓存的嵌入模型
+    
+    查询向量按归一化后的问题文本缓存，重复的问题不再请求嵌入服务。
+    文档向量不缓存，直接交给底层模型。
+    """
+    def __init__(self, embedding: Embeddings, size: int = 256):
+        self.embedding = embedding
+        self.size = size
+        self.cache: OrderedDict[str, List[float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        
+        
+    def lookup(self, key: str) -> List[float] | None:
+        vector = self.cache.get(key)
+        if vector is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.cache.move_to_end(key)
+        return vector
+    
+    
+    def store(self, key: str, vector: List[float]):
+        if self.size <= 0:
+            return
+        self.cache[key] = vector
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+        
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embedding.embed_documents(texts)
+
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.embedding.aembed_documents(texts)
+
+
+    def embed_query(self, text: str) -> List[float]:
+        key = normalize_query(text)
+        vector = self.lookup(key)
+        if vector is None:
+            vector = self.embedding.embed_query(text)
+            self.store(key, vector)
+        return vector
+
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = normalize_query(text)
+        vector = self.lookup(key)
+        if vector is None:
+            vector = await self.embedding.aembed_query(text)
+            self.store(key, vector)
+        return vector
+
+
 embedding_config = config.get("embedding", {})
-embedding = OpenAIEmbeddings(
-    base_url=embedding_config.get("api_endpoint", "https://api.openai.com/v1/embeddings"),
-    api_key=embedding_config.get("api_key", ""),
-    model=embedding_config.get("model", "text-embedding-ada-002"),
+embedding = CachedEmbeddings(
+    OpenAIEmbeddings(
+        base_url=embedding_config.get("api_endpoint", "https://api.openai.com/v1/embeddings"),
+        api_key=embedding_config.get("api_key", ""),
+        model=embedding_config.get("model", "text-embedding-ada-002"),
+    ),
+    size=config.get("cache_size", 256),
 )
 
-top_k = config.get("top_k", 3)
-
 
 def load_docs_from_json() -> List[Document]:
     start_time = time.time()
@@ -73,31 +160,327 @@ def load_docs_from_json() -> List[Document]:
     return documents
 
 
-def create_retriever(documents: List[Document]):
+def document_id(doc: Document) -> str:
+    """
+    按问题和答案的内容计算文档ID，内容不变时ID不变
+    """
+    content = doc.page_content + "\0" + doc.metadata.get("original_answer", "")
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def text_embeddings(documents: dict[str, Document], vectors: dict[str, List[float]]) -> list[tuple[str, List[float]]]:
+    return [(doc.page_content, vectors[id]) for id, doc in documents.items()]
+
+
+def create_vectorstore(documents: dict[str, Document], vectors: dict[str, List[float]]) -> FAISS:
     start_time = time.time()
-    logging.info("Creating retriever...")
+    logging.info("Creating vector store...")
     
     if not documents:
-        raise ValueError("No documents found to create retriever.")
-    logging.info(f"Creating retriever with {len(documents)} documents.")
+        raise ValueError("No documents found to create vector store.")
+    logging.info(f"Creating vector store with {len(documents)} documents.")
     
     try:
-        vectorstore = FAISS.from_documents(
-            documents,
-            embedding
+        vectorstore = FAISS.from_embeddings(
+            text_embeddings(documents, vectors),
+            embedding,
+            metadatas=[doc.metadata for doc in documents.values()],
+            ids=list(documents)
         )
-        retriever = vectorstore.as_retriever(search_kwargs={"k": top_k})
     except Exception as e:
-        logging.error(f"Error creating retriever: {str(e)}")
+        logging.error(f"Error creating vector store: {str(e)}")
         raise e
     
     end_time = time.time()
-    logging.info(f"Retriever created in {end_time - start_time:.2f} seconds.")
+    logging.info(f"Vector store created in {end_time - start_time:.2f} seconds.")
+    
+    return vectorstore
+
+
+def load_index(model: str) -> tuple[FAISS, dict] | None:
+    """
+    读取保存的索引和清单
+
+    清单记录嵌入模型名称和每个文档的ID（内容哈希），模型不同或索引与清单不一致时返回None。
+    """
+    try:
+        with open(os.path.join(index_dir, MANIFEST), 'r', encoding='utf-8') as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning(f"Invalid RAG index manifest, rebuilding: {e}")
+        return None
+    
+    if manifest.get("model") != model:
+        logging.info(f"Embedding model changed from {manifest.get('model')} to {model}, rebuilding RAG index")
+        return None
+    
+    try:
+        # 索引文件由本程序写入，可以信任其中的pickle数据
+        vectorstore = FAISS.load_local(index_dir, embedding, allow_dangerous_deserialization=True)
+    except Exception as e:
+        logging.warning(f"Failed to load RAG index, rebuilding: {e}")
+        return None
+    
+    if set(vectorstore.index_to_docstore_id.values()) != set(manifest.get("documents", {})):
+        logging.warning("RAG index does not match its manifest, rebuilding")
+        return None
+    return vectorstore, manifest
+
+
+def save_index(vectorstore: FAISS, model: str, documents: dict[str, Document]):
+    """
+    保存索引，清单最后写入，保存中断时下次启动会重建索引
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    manifest_path = os.path.join(index_dir, MANIFEST)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    vectorstore.save_local(index_dir)
+    
+    manifest = {
+        "model": model,
+        "documents": {id: doc.metadata.get("source_doc_id", "") for id, doc in documents.items()},
+    }
+    with open(manifest_path + ".tmp", 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def make_ingestor(model: str) -> EmbeddingIngestor:
+    return EmbeddingIngestor(
+        embedding,
+        model=model,
+        count=get_counter(ingest_config.get("counter", "char"), ingest_config.get("encoding", "cl100k_base")),
+        batch_tokens=ingest_config.get("batch_tokens", 8192),
+        batch_size=ingest_config.get("batch_size", 64),
+        concurrency=ingest_config.get("concurrency", 4),
+        retries=ingest_config.get("retries", 3),
+        backoff=ingest_config.get("backoff", 1.0),
+        checkpoint=os.path.join(index_dir, CHECKPOINT),
+    )
+
+
+async def load_vectorstore(documents: List[Document]) -> FAISS:
+    """
+    加载向量索引，只为新增或修改的问答计算向量
+
+    索引保存在index_dir中。启动时与保存的清单比较文档内容哈希：
+    删除已经不存在的文档，只对新增和修改过的文档请求嵌入服务，没有变化时直接加载。
+    向量由EmbeddingIngestor分批并发计算，读写索引在线程池中执行。
+    """
+    start_time = time.time()
+    loop = asyncio.get_running_loop()
+    model = embedding_config.get("model", "text-embedding-ada-002")
+    
+    current: dict[str, Document] = {}
+    for doc in documents:
+        current.setdefault(document_id(doc), doc)
+    if not current:
+        raise ValueError("No documents found to create vector store.")
+    
+    ingestor = make_ingestor(model)
+    loaded = await loop.run_in_executor(None, load_index, model)
+    if loaded is None:
+        vectors = await ingestor.embed([(id, doc.page_content) for id, doc in current.items()])
+        vectorstore = await loop.run_in_executor(None, create_vectorstore, current, vectors)
+        await loop.run_in_executor(None, save_index, vectorstore, model, current)
+        ingestor.checkpoint.remove()
+        return vectorstore
+    
+    vectorstore, manifest = loaded
+    indexed = manifest.get("documents", {})
+    removed = [id for id in indexed if id not in current]
+    added = {id: doc for id, doc in current.items() if id not in indexed}
+    moved = [id for id, doc in current.items() if id in indexed and indexed[id] != doc.metadata.get("source_doc_id", "")]
     
-    return retriever
+    if not removed and not added and not moved:
+        logging.info(f"Loaded RAG index with {len(current)} documents in {time.time() - start_time:.2f} seconds.")
+        return vectorstore
+    
+    vectors = await ingestor.embed([(id, doc.page_content) for id, doc in added.items()]) if added else {}
+    
+    def update():
+        if removed:
+            vectorstore.delete(removed)
+        if added:
+            vectorstore.add_embeddings(
+                text_embeddings(added, vectors),
+                metadatas=[doc.metadata for doc in added.values()],
+                ids=list(added)
+            )
+        if moved:
+            # 内容未变、位置变化的文档只更新元数据，不重新计算向量
+            vectorstore.docstore.delete(moved)
+            vectorstore.docstore.add({id: current[id] for id in moved})
+        save_index(vectorstore, model, current)
+    
+    await loop.run_in_executor(None, update)
+    ingestor.checkpoint.remove()
+    
+    logging.info(
+        f"Updated RAG index in {time.time() - start_time:.2f} seconds: "
+        f"{len(added)} added, {len(removed)} removed, {len(moved)} moved, {len(current)} total."
+    )
+    return vectorstore
+
+
+def keyword_search(query: str, documents: List[Document], k: int) -> List[Document]:
+    """
+    按字符二元组重合度检索问答，向量索引未就绪时作为降级方案
+    """
+    def bigrams(text: str) -> set[str]:
+        text = normalize_query(text)
+        return {text[i:i + 2] for i in range(len(text) - 1)} or {text}
+    
+    terms = bigrams(query)
+    scored = []
+    for doc in documents:
+        score = len(terms & bigrams(doc.page_content))
+        if score:
+            scored.append((score, doc))
+    scored.sort(key=lambda item: item[0], reverse=True)
+    return [doc for _, doc in scored[:k]]
+
+
+class RAGIndex:
+    """
+    在后台构建的RAG索引
+
+    服务启动后在后台任务中读取问答并加载向量索引，不阻塞HTTP服务的启动；
+    嵌入服务不可用时按退避间隔重试。索引就绪之前以及向量检索失败时，使用关键词检索。
+
+    Attributes:
+        state: 索引状态 (idle, loading, ready, failed)
+    """
+    def __init__(self, retry: float = 60, faq_threshold: float = 0.95):
+        self.state = "idle"
+        self.documents: List[Document] = []
+        # 归一化问题到问答的索引，用于精确匹配
+        self.faq: dict[str, Document] = {}
+        self.faq_threshold = faq_threshold
+        self.vectorstore: FAISS | None = None
+        self.error = ""
+        self.retry = retry
+        self.ready_time: float | None = None
+        self.task: asyncio.Task | None = None
+        
+        
+    def start(self) -> asyncio.Task:
+        """
+        启动后台初始化，已经启动时返回原有任务
+        """
+        if self.task is None:
+            self.task = asyncio.create_task(self.initialize())
+        return self.task
+        
+        
+    async def initialize(self):
+        loop = asyncio.get_running_loop()
+        start_time = time.time()
+        backoff = 5.0
+        while True:
+            self.state = "loading"
+            try:
+                if not self.documents:
+                    self.documents = await loop.run_in_executor(None, load_docs_from_json)
+                    for doc in self.documents:
+                        self.faq.setdefault(normalize_query(doc.page_content), doc)
+                self.vectorstore = await load_vectorstore(self.documents)
+            except Exception as e:
+                self.state = "failed"
+                self.error = str(e)
+                logging.error(f"Failed to initialize RAG index, retrying in {backoff:.0f}s: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.retry)
+                continue
+            
+            self.state = "ready"
+            self.error = ""
+            self.ready_time = time.time() - start_time
+            logging.info(f"RAG index ready in {self.ready_time:.2f} seconds.")
+            return
+        
+        
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+        
+        
+    def status(self) -> dict:
+        return {
+            "state": self.state,
+            "ready": self.ready,
+            "documents": len(self.documents),
+            "indexed": self.vectorstore.index.ntotal if self.vectorstore is not None else 0,
+            "error": self.error,
+            "ready_time": self.ready_time,
+        }
 
 
-retriever = create_retriever(load_docs_from_json())
+    def nearest(self, vector: List[float]) -> tuple[Document, float] | None:
+        """
+        查找最相近的问答并计算余弦相似度
+        """
+        query = np.asarray(vector, dtype=np.float32).reshape(1, -1)
+        _, indices = self.vectorstore.index.search(query, 1)
+        index = int(indices[0][0])
+        if index < 0:
+            return None
+        stored = self.vectorstore.index.reconstruct(index)
+        norm = float(np.linalg.norm(query) * np.linalg.norm(stored))
+        similarity = float(query[0] @ stored) / norm if norm else 0.0
+        return self.vectorstore.docstore.search(self.vectorstore.index_to_docstore_id[index]), similarity
+
+
+    async def match(self, query: str) -> tuple[Document, float] | None:
+        """
+        在问答库中查找与问题相同的问题
+
+        先按归一化后的问题精确匹配；索引就绪时再按向量相似度匹配，相似度不低于faq_threshold时命中。
+        查询向量进入缓存，未命中时后续的检索不会重复请求嵌入服务。
+
+        Returns:
+            tuple[Document, float] | None: 命中的问答和相似度，未命中时返回None
+        """
+        doc = self.faq.get(normalize_query(query))
+        if doc is not None:
+            return doc, 1.0
+        if not self.ready or self.faq_threshold > 1:
+            return None
+        try:
+            vector = await embedding.aembed_query(query)
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(None, self.nearest, vector)
+        except Exception as e:
+            logging.error(f"FAQ matching failed: {e}")
+            return None
+        if result is None or result[1] < self.faq_threshold:
+            return None
+        return result
+
+
+    async def retrieve(self, query: str) -> List[Document]:
+        """
+        检索与问题最相关的问答
+        
+        查询向量通过异步请求获取（命中缓存时不请求嵌入服务），FAISS检索在线程池中执行，
+        检索期间不阻塞事件循环。索引未就绪或嵌入服务出错时使用关键词检索。
+        """
+        if self.ready:
+            try:
+                vector = await embedding.aembed_query(query)
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(None, self.vectorstore.similarity_search_by_vector, vector, top_k)
+            except Exception as e:
+                logging.error(f"Vector retrieval failed, using keyword search: {e}")
+        else:
+            logging.warning(f"RAG index {self.state}, using keyword search")
+        return keyword_search(query, self.documents, top_k)
+
+
+rag_index = RAGIndex(retry=config.get("retry", 60), faq_threshold=faq_config.get("threshold", 0.95))
 
 
 def format_retrieved_docs(docs: List[Document]) -> str:
@@ -113,11 +496,11 @@ def format_retrieved_docs(docs: List[Document]) -> str:
     return "\n\n".join(formatted_docs)
 
 
-def invoke_rag(query: str) -> str:
+async def invoke_rag(query: str) -> str:
     start_time = time.time()
     logging.info("Invoking RAG...")
     
-    retrieval_docs = retriever.invoke(query)
+    retrieval_docs = await rag_index.retrieve(query)
     
     formatted_docs = format_retrieved_docs(retrieval_docs)
     
@@ -129,19 +512,61 @@ def invoke_rag(query: str) -> str:
     )
     
     end_time = time.time()
-    logging.info(f"RAG invoked in {end_time - start_time:.2f} seconds.")
+    logging.info(f"RAG invoked in {end_time - start_time:.2f} seconds (embedding cache: {embedding.hits} hits, {embedding.misses} misses).")
     
     return formatted_docs
 
 
-class RAG(OpenAI):
-    def set_body(self, message: str) -> dict:
-        message = invoke_rag(message)
-        return super().set_body(message)
+def split_answer(answer: str) -> List[str]:
+    """
+    把预置答案按标点切成小段，模拟模型的流式输出
+    """
+    return [part for part in re.split(r"(?<=[，。！？；,.!?;\n])", answer) if part]
+
+
+class RAGMixin:
+    """
+    为GPT客户端加入检索增强
+
+    问题与问答库中的问题相同时（FAQ快速通道）直接流式返回预置答案，不请求模型；
+    否则检索相关问答填入模板后再请求模型。
+    """
+    faq_enable = faq_config.get("enable", True)
+    
+    
+    async def prepare(self, message: str, session_id: str) -> str:
+        return await invoke_rag(message)
     
+    
+    async def answer_stream(self, message: str, session_id: str, answer: str):
+        """
+        以模型自己的SSE格式输出预置答案，后续的解析、分句和TTS流程与模型输出相同
+        """
+        self.set_body(message, session_id)
+        for part in split_answer(answer):
+            yield self.make_chunk(part)
+        yield self.make_chunk("", "stop")
+        yield None
+    
+    
+    async def generate_stream(self, message: str, session_id: str):
+        if self.faq_enable and rag_index.faq:
+            start_time = time.time()
+            matched = await rag_index.match(message)
+            if matched is not None:
+                doc, similarity = matched
+                logging.info(f"FAQ hit ({similarity:.3f}) in {time.time() - start_time:.2f}s: {doc.page_content}")
+                async for chunk in self.answer_stream(message, session_id, doc.metadata.get("original_answer", "")):
+                    yield chunk
+                return
+        
+        async for chunk in super().generate_stream(message, session_id):
+            yield chunk
 
-class RAG_Qwen(Qwen):
-    def set_body(self, message: str) -> dict:
-        message = invoke_rag(message)
-        return super().set_body(message)
+
+class RAG(RAGMixin, OpenAI):
+    pass
     
+
+class RAG_Qwen(RAGMixin, Qwen):
+    pass
@@ -11,5 +11,8 @@ def Player(socketio):
     elif mode == "audio2face":
         from .audio2face import Audio2Face
         return Audio2Face(socketio)
+    elif mode in ("pcm", "null"):
+        from .pcmplayer import PCMPlayer
+        return PCMPlayer(sink="null" if mode == "null" else "pyaudio")
     else:
         raise ValueError(f"Invalid Player type: {mode}")
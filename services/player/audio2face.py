@@ -1,98 +1,303 @@
 from .localplayer import LocalPlayer
 import grpc
 import time
-import soundfile
 from . import audio2face_pb2, audio2face_pb2_grpc
 import asyncio
 from utils import get_logger, Config
+from utils.audio import AudioStream, Resampler
+import numpy as np
 
 logging = get_logger()
 config = Config.get("Player", "").get("Audio2Face", "")
 
 
+class ChannelPool:
+    """
+    Audio2Face的gRPC长连接池
+
+    连接在多轮对话之间复用并开启keepalive，每次取用前检查连接状态，
+    无法在health_timeout内就绪的连接会被重建。
+    """
+    def __init__(self, url: str, size: int = 1, keepalive: float = 10, health_timeout: float = 1):
+        self.url = url
+        self.size = max(size, 1)
+        self.health_timeout = health_timeout
+        self.options = [
+            ("grpc.keepalive_time_ms", int(keepalive * 1000)),
+            ("grpc.keepalive_timeout_ms", 5000),
+            ("grpc.keepalive_permit_without_calls", 1),
+            ("grpc.http2.max_pings_without_data", 0),
+        ]
+        self.channels: list[grpc.aio.Channel] = []
+        self.index = 0
+
+
+    def create(self) -> grpc.aio.Channel:
+        logging.info(f"Connecting to audio2face at {self.url}")
+        return grpc.aio.insecure_channel(self.url, options=self.options)
+
+
+    async def check(self, channel: grpc.aio.Channel) -> bool:
+        """
+        检查连接是否可用，空闲的连接会被唤醒重连
+        """
+        state = channel.get_state(try_to_connect=True)
+        if state == grpc.ChannelConnectivity.READY:
+            return True
+        if state == grpc.ChannelConnectivity.SHUTDOWN:
+            return False
+        try:
+            await asyncio.wait_for(channel.channel_ready(), self.health_timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+    async def acquire(self) -> grpc.aio.Channel:
+        """
+        按轮询取出一个连接，不健康的连接替换为新连接
+        """
+        if len(self.channels) < self.size:
+            channel = self.create()
+            self.channels.append(channel)
+            return channel
+
+        index = self.index
+        self.index = (self.index + 1) % self.size
+        channel = self.channels[index]
+        if not await self.check(channel):
+            logging.warning(f"Audio2Face channel unhealthy ({channel.get_state()}), reconnecting")
+            await self.discard(channel)
+            channel = self.channels[index]
+        return channel
+
+
+    async def discard(self, channel: grpc.aio.Channel):
+        """
+        关闭出错的连接并用新连接替换
+        """
+        if channel in self.channels:
+            self.channels[self.channels.index(channel)] = self.create()
+        await channel.close()
+
+
+class Pacer:
+    """
+    按单调时钟和音频位置计算发送时间的节拍器
+
+    每块音频在其播放时间之前lead秒发送，发送时间由开始时刻加上已发送的音频时长算出，
+    不会因为sleep的误差和发送耗时而累积漂移。
+    - overrun: 发送晚于计划时间超过tolerance，但接收端仍有缓冲（占用了领先量）
+    - underrun: 发送时接收端已经播放完之前的所有音频，之后以当前时刻重新对齐
+    """
+    def __init__(self, lead: float = 0.2, tolerance: float = 0.02):
+        self.lead = lead
+        self.tolerance = tolerance
+        self.origin = 0.0
+        self.position = 0.0
+        self.underruns = 0
+        self.overruns = 0
+        self.max_late = 0.0
+
+
+    def start(self):
+        self.origin = time.monotonic()
+        self.position = 0.0
+
+
+    async def wait(self, duration: float):
+        """
+        等待到下一块音频的发送时间
+
+        Args:
+            duration: 这一块音频的时长（秒）
+        """
+        if self.position == 0:
+            # 以第一块音频的发送时刻作为播放起点
+            self.origin = time.monotonic()
+            self.position = duration
+            return
+
+        deadline = self.origin + self.position + duration - self.lead
+        delay = deadline - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        now = time.monotonic()
+        late = now - max(deadline, self.origin)
+        self.max_late = max(self.max_late, late)
+        starved = now - (self.origin + self.position)
+        if starved > 0:
+            self.underruns += 1
+            self.origin += starved
+        elif late > self.tolerance:
+            self.overruns += 1
+        self.position += duration
+
+
+# 同一进程内的会话共用连接池
+_pools: dict[str, ChannelPool] = {}
+
+
+def get_pool(url: str) -> ChannelPool:
+    if url not in _pools:
+        _pools[url] = ChannelPool(
+            url,
+            size=config.get("pool_size", 1),
+            keepalive=config.get("keepalive", 10),
+            health_timeout=config.get("health_timeout", 1),
+        )
+    return _pools[url]
+
+
 class Audio2Face(LocalPlayer):
     def __init__(self, socketio):
         self.socketio = socketio
         self.BLOCK_UNTIL_PLAYBACK_IS_FINISHED = True
-        self.SLEEP_BETWEEN_CHUNKS = 0.09
-        
+        # 每块音频的时长，以及发送进度领先播放进度的时长（秒）
+        self.chunk_seconds = config.get("chunk", 0.1)
+        self.lead = config.get("lead", 0.2)
+
         self.url = config.get("url", "localhost:50051")
         self.player = config.get("player", "default")
-        
-        
-    async def play(self, filename: str, stub: audio2face_pb2_grpc.Audio2FaceStub):
-        try:
-            # 记录开始时间
-            start_time = time.time()
-            
-            audio_data, samplerate = soundfile.read(filename, dtype="float32")
-            duration = len(audio_data) / samplerate
-            logging.info(f"Audio duration: {duration:.2f}s")
+        # sentence: 每句一个PushAudioStream；answer: 整个回答共用一个PushAudioStream
+        self.stream_mode = config.get("stream_mode", "sentence")
+        # answer模式下发送的采样率，为空时使用第一句的采样率
+        self.samplerate = config.get("samplerate")
+        self.pool = get_pool(self.url)
+
 
-            async def make_generator():
-                """创建发送音频数据的异步生成器"""
-                start_marker = audio2face_pb2.PushAudioRequestStart(
-                    samplerate=samplerate, # type: ignore
-                    instance_name=self.player, # type: ignore
-                    block_until_playback_is_finished=self.BLOCK_UNTIL_PLAYBACK_IS_FINISHED, # type: ignore
-                )
-                CHUNK_SIZE = samplerate // 10
-                
-                yield audio2face_pb2.PushAudioStreamRequest(start_marker=start_marker) # type: ignore
-                
-                for i in range(len(audio_data) // CHUNK_SIZE + 1):
-                    await asyncio.sleep(self.SLEEP_BETWEEN_CHUNKS)
-                    chunk = audio_data[i * CHUNK_SIZE: i * CHUNK_SIZE + CHUNK_SIZE]
-                    yield audio2face_pb2.PushAudioStreamRequest(audio_data=chunk.tobytes()) # type: ignore
+    async def make_generator(self, streams, samplerate: int, pacer: Pacer):
+        """
+        创建发送音频数据的异步生成器，边接收边发送
 
+        多个句子的PCM依次拼接到同一个请求流中，采样率不同的句子重采样到samplerate。
+
+        Args:
+            streams: AudioStream的异步迭代器
+            samplerate: 发送的采样率
+            pacer: 控制每块音频发送时间的节拍器
+        """
+        start_marker = audio2face_pb2.PushAudioRequestStart(
+            samplerate=samplerate, # type: ignore
+            instance_name=self.player, # type: ignore
+            block_until_playback_is_finished=self.BLOCK_UNTIL_PLAYBACK_IS_FINISHED, # type: ignore
+        )
+        CHUNK_SIZE = max(int(samplerate * self.chunk_seconds), 1)
+
+        yield audio2face_pb2.PushAudioStreamRequest(start_marker=start_marker) # type: ignore
+        pacer.start()
+
+        buffer = np.zeros(0, np.float32)
+        async for stream in streams:
+            resampler = Resampler(stream.samplerate, samplerate)
+            try:
+                async for pcm in stream:
+                    if pcm.ndim > 1:
+                        pcm = pcm.mean(axis=1, dtype=np.float32)
+                    buffer = np.concatenate((buffer, resampler.process(pcm)))
+                    while len(buffer) >= CHUNK_SIZE:
+                        await pacer.wait(CHUNK_SIZE / samplerate)
+                        chunk, buffer = buffer[:CHUNK_SIZE], buffer[CHUNK_SIZE:]
+                        yield audio2face_pb2.PushAudioStreamRequest(audio_data=chunk.tobytes()) # type: ignore
+            except Exception as e:
+                logging.error(f"Failed to receive audio, sentence truncated: {e}")
+
+        await pacer.wait(len(buffer) / samplerate)
+        yield audio2face_pb2.PushAudioStreamRequest(audio_data=buffer.tobytes()) # type: ignore
+
+
+    async def push(self, streams, samplerate: int, channel: grpc.aio.Channel) -> bool:
+        """
+        通过一个PushAudioStream发送音频
+
+        Returns:
+            bool: 是否发送成功
+        """
+        pacer = Pacer(self.lead)
+        try:
+            stub = audio2face_pb2_grpc.Audio2FaceStub(channel)
             logging.info(f"Sending audio to audio2face")
-            await stub.PushAudioStream(make_generator())
-            
+            await stub.PushAudioStream(self.make_generator(streams, samplerate, pacer))
+
+        except grpc.aio.AioRpcError as e:
+            logging.error(f"Failed to send audio to audio2face: {e.code()}: {e.details()}")
+            if e.code() == grpc.StatusCode.UNAVAILABLE:
+                await self.pool.discard(channel)
+            return False
         except Exception as e:
             logging.error(f"Failed to send audio to audio2face: {e}")
-            return
+            return False
         else:
             logging.info(f"Successfully sent audio to audio2face")
-            
+            return True
+        finally:
+            log = logging.warning if pacer.underruns or pacer.overruns else logging.info
+            log(f"Audio2Face pacing: underruns={pacer.underruns}, overruns={pacer.overruns}, max late={pacer.max_late * 1000:.0f}ms")
+
+
+    async def play(self, stream: AudioStream, channel: grpc.aio.Channel):
+        # 记录开始时间
+        start_time = time.time()
+
+        async def single():
+            yield stream
+
+        if await self.push(single(), stream.samplerate, channel):
             # 记录结束时间
             end_time = time.time()
+            duration = stream.duration
+            logging.info(f"Audio duration: {duration:.2f}s")
             logging.info(f"Excluding the time consumed by the audio duration: {end_time - start_time - duration:.2f}s")
             logging.info(f"Audio playback time: {end_time - start_time:.2f}s")
-        finally:
-            self.remove_audio(filename)
+
+
+    async def play_answer(self, first: AudioStream, audio_queue: asyncio.Queue, channel: grpc.aio.Channel):
+        """
+        把整个回答的所有句子拼接到一个PushAudioStream中发送，句子之间没有间隙
+        """
+        start_time = time.time()
+        duration = 0.0
+
+        async def streams():
+            nonlocal duration
+            stream = first
+            while stream is not None:
+                yield stream
+                duration += stream.duration
+                stream = await audio_queue.get()
+
+        if await self.push(streams(), self.samplerate or first.samplerate, channel):
+            end_time = time.time()
+            logging.info(f"Answer audio duration: {duration:.2f}s")
+            logging.info(f"Excluding the time consumed by the audio duration: {end_time - start_time - duration:.2f}s")
 
 
     async def run(self, audio_queue: asyncio.Queue, start_time):
         first_play = True
-        
+
         try:
-            channel = grpc.aio.insecure_channel(self.url)
-            logging.info(f"Connecting to audio2face at {self.url}")
-            
-            stub = audio2face_pb2_grpc.Audio2FaceStub(channel)
-            
+            channel = await self.pool.acquire()
+
             while True:
-                audio_file = await audio_queue.get()
-                if audio_file is None:
+                stream = await audio_queue.get()
+                if stream is None:
                     break
-                
+
                 if first_play:
                     logging.info(f"First playing audio time: {time.time() - start_time:.2f}s")
                     first_play = False
-                    
+
                 await self.socketio.emit(
-                        'aniplay', 
+                        'aniplay',
                         'play',
                         namespace='/ue'
                     )
-                
-                await self.play(audio_file, stub)
+
+                if self.stream_mode == "answer":
+                    await self.play_answer(stream, audio_queue, channel)
+                    break
+                await self.play(stream, channel)
         except asyncio.CancelledError:
             logging.info("Audio player cancelled")
             raise
-        finally:
-            await channel.close()
-            while not audio_queue.empty():
-                filename = audio_queue.get_nowait()
-                if filename is not None:
-                    self.remove_audio(filename)
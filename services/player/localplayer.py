@@ -1,57 +1,94 @@
 import pygame
-import os
 import asyncio
+import numpy as np
+from collections import deque
 from utils import get_logger
+from utils.audio import AudioStream
 import time
 
 logging = get_logger()
 
+# pygame混音器和通道0是进程内全局的，所有会话的播放器共用；每句播放期间独占，
+# 避免其他会话覆盖排队中的片段或重新初始化混音器打断正在播放的音频
+_output_lock = asyncio.Lock()
+
 
 class LocalPlayer:
+    # 每次交给混音器的最短音频长度（秒）
+    MIN_CHUNK_SECONDS = 0.1
+    
     def __init__(self):
         pygame.mixer.init()
         
     
-    @staticmethod
-    def remove_audio(filename: str):
+    def setup(self, samplerate: int, channels: int):
         """
-        删除音频文件
-        
-        Args:
-            filename: 要删除的音频文件路径
+        按音频格式初始化混音器，格式不变时不会重新初始化
         """
-        try:
-            os.remove(filename)
-        except Exception as e:
-            pass
+        if pygame.mixer.get_init() != (samplerate, -16, channels):
+            pygame.mixer.quit()
+            pygame.mixer.init(frequency=samplerate, size=-16, channels=channels, allowedchanges=0)
+            
+            
+    @staticmethod
+    def make_sound(chunks: list[np.ndarray]) -> pygame.mixer.Sound:
+        pcm = np.concatenate(chunks) if len(chunks) > 1 else chunks[0]
+        data = (np.clip(pcm, -1.0, 1.0) * 32767).astype(np.int16)
+        return pygame.mixer.Sound(buffer=data.tobytes())
         
     
-    async def play(self, filename: str):
+    async def play(self, stream: AudioStream):
         """
-        本地播放音频文件
+        本地播放音频
         
-        使用pygame加载并播放音频，播放完成后删除文件
+        边接收边播放：把收到的PCM帧攒成短片段，依次排入pygame的播放通道。
+        多个会话同时播放时按句轮流占用通道
         
         Args:
-            filename: 要播放的音频文件路径
+            stream: 要播放的音频流
         """
+        async with _output_lock:
+            await self.play_locked(stream)
+            
+            
+    async def play_locked(self, stream: AudioStream):
+        channel = None
         try:
-            pygame.mixer.music.load(filename)
-            pygame.mixer.music.play()
+            self.setup(stream.samplerate, stream.channels)
+            channel = pygame.mixer.Channel(0)
+            min_frames = int(stream.samplerate * self.MIN_CHUNK_SECONDS)
+            # 保留正在播放和排队中的片段的引用
+            sounds = deque(maxlen=2)
+            chunks, frames = [], 0
+            
+            async def submit():
+                # 通道中已有排队的片段时等待其开始播放，空闲的通道会立即播放
+                while channel.get_queue() is not None:
+                    await asyncio.sleep(0.01)
+                sound = self.make_sound(chunks)
+                sounds.append(sound)
+                channel.queue(sound)
+            
+            async for pcm in stream:
+                chunks.append(pcm)
+                frames += len(pcm)
+                if frames >= min_frames:
+                    await submit()
+                    chunks, frames = [], 0
+            if chunks:
+                await submit()
             
             # 等待当前音频播放完成
-            while pygame.mixer.music.get_busy():
-                await asyncio.sleep(0.1)
+            while channel.get_busy():
+                await asyncio.sleep(0.02)
             
         except Exception as e:
             logging.error(f"Failed to play audio: {e}")
             return
         
         finally:
-            pygame.mixer.music.stop()
-            pygame.mixer.music.unload()
-            await asyncio.sleep(0.1)
-            self.remove_audio(filename)
+            if channel is not None:
+                channel.stop()
             
     
     async def run(self, audio_queue: asyncio.Queue, start_time):
@@ -59,18 +96,13 @@ class LocalPlayer:
         
         try:
             while True:
-                audio_file = await audio_queue.get()
-                if audio_file is None:
+                stream = await audio_queue.get()
+                if stream is None:
                     break
                 if first_play:
                     logging.info(f"First playing audio time: {time.time() - start_time:.2f}s")
                     first_play = False
-                await self.play(audio_file)
+                await self.play(stream)
         except asyncio.CancelledError:
             logging.info("Audio player cancelled")
             raise
-        finally:
-            while not audio_queue.empty():
-                filename = audio_queue.get_nowait()
-                if filename is not None:
-                    self.remove_audio(filename)
@@ -0,0 +1,421 @@
+import time
+import asyncio
+import threading
+from collections import deque
+
+import numpy as np
+
+from utils import get_logger, Config
+from utils.audio import AudioStream
+
+logging = get_logger()
+config = Config.get("Player", {}).get("PCM", {}) or {}
+
+
+class PCMRingBuffer:
+    """
+    float32 PCM环形缓冲区
+
+    事件循环写入、声卡回调线程读取。读写位置都是累计帧数，
+    可以用来判断某一帧是否已经交给声卡。
+    """
+    def __init__(self, capacity: int, channels: int):
+        self.data = np.zeros((capacity, channels), np.float32)
+        self.capacity = capacity
+        self.read_pos = 0
+        self.write_pos = 0
+        self.lock = threading.Lock()
+
+
+    @property
+    def available(self) -> int:
+        return self.write_pos - self.read_pos
+
+
+    @property
+    def free(self) -> int:
+        return self.capacity - self.available
+
+
+    def write(self, pcm: np.ndarray) -> int:
+        """
+        写入尽可能多的帧
+
+        Args:
+            pcm: (帧数, 声道数)的PCM数据
+
+        Returns:
+            int: 实际写入的帧数，缓冲区满时可能小于输入长度
+        """
+        with self.lock:
+            frames = min(len(pcm), self.free)
+            start = self.write_pos % self.capacity
+            first = min(frames, self.capacity - start)
+            self.data[start:start + first] = pcm[:first]
+            self.data[:frames - first] = pcm[first:frames]
+            self.write_pos += frames
+        return frames
+
+
+    def read(self, out: np.ndarray) -> int:
+        """
+        读取数据填满out，数据不足的部分填充静音
+
+        Returns:
+            int: 实际读出的帧数
+        """
+        with self.lock:
+            frames = min(len(out), self.available)
+            start = self.read_pos % self.capacity
+            first = min(frames, self.capacity - start)
+            out[:first] = self.data[start:start + first]
+            out[first:frames] = self.data[:frames - first]
+            out[frames:] = 0
+            self.read_pos += frames
+        return frames
+
+
+    def clear(self):
+        with self.lock:
+            self.read_pos = self.write_pos
+
+
+    def discard(self, start: int, end: int):
+        """
+        丢弃[start, end)中尚未读出的帧
+
+        该段位于缓冲区末尾时直接回退写入位置，否则填充静音，不影响之后写入的其他音频。
+        """
+        with self.lock:
+            start = max(start, self.read_pos)
+            end = min(end, self.write_pos)
+            if start >= end:
+                return
+            if end == self.write_pos:
+                self.write_pos = start
+                return
+            frames = end - start
+            offset = start % self.capacity
+            first = min(frames, self.capacity - offset)
+            self.data[offset:offset + first] = 0
+            self.data[:frames - first] = 0
+
+
+class PyAudioSink:
+    """
+    通过PyAudio回调向声卡输出
+    """
+    def __init__(self, device: int | None = None):
+        self.device = device
+        self.audio = None
+        self.stream = None
+
+
+    def open(self, samplerate: int, channels: int, block: int, callback):
+        import pyaudio
+
+        def stream_callback(in_data, frame_count, time_info, status):
+            return callback(frame_count).tobytes(), pyaudio.paContinue
+
+        self.audio = pyaudio.PyAudio()
+        self.stream = self.audio.open(
+            format=pyaudio.paFloat32,
+            channels=channels,
+            rate=samplerate,
+            output=True,
+            output_device_index=self.device,
+            frames_per_buffer=block,
+            stream_callback=stream_callback,
+        )
+
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+        if self.audio is not None:
+            self.audio.terminate()
+            self.audio = None
+
+
+class NullSink:
+    """
+    不输出声音，按实时速度消费音频，用于没有声卡的环境测试
+    """
+    def __init__(self):
+        self.thread = None
+        self.stopped = threading.Event()
+
+
+    def open(self, samplerate: int, channels: int, block: int, callback):
+        def consume():
+            deadline = time.monotonic()
+            while not self.stopped.is_set():
+                callback(block)
+                deadline += block / samplerate
+                self.stopped.wait(max(deadline - time.monotonic(), 0))
+
+        self.stopped.clear()
+        self.thread = threading.Thread(target=consume, name="null-sink", daemon=True)
+        self.thread.start()
+
+
+    def close(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+class PCMOutput:
+    """
+    连续输出的PCM设备
+
+    各句音频依次写入同一个环形缓冲区，声卡持续读取，句子之间没有间隙。
+    每句写完后记录一个结束位置，声卡取走该位置之前的所有帧时对应的future完成。
+    多个会话共用同一个输出时，每句音频在持有lock期间连续写入，不会与其他会话的音频交错。
+    """
+    def __init__(self, sink: str = "pyaudio", channels: int = 1, buffer: float = 0.5, block: float = 0.02, device: int | None = None):
+        self.sink_type = sink
+        self.channels = channels
+        self.buffer_seconds = buffer
+        self.block_seconds = block
+        self.device = device
+        self.samplerate = 0
+        self.sink = None
+        self.ring: PCMRingBuffer | None = None
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.space = asyncio.Event()
+        self.markers: deque[tuple[int, asyncio.Future]] = deque()
+        self.lock = asyncio.Lock()
+        self.writing = False
+        self.underruns = 0
+
+
+    def open(self, samplerate: int):
+        self.loop = asyncio.get_running_loop()
+        self.samplerate = samplerate
+        self.ring = PCMRingBuffer(max(int(samplerate * self.buffer_seconds), 1), self.channels)
+        self.sink = NullSink() if self.sink_type == "null" else PyAudioSink(self.device)
+        self.sink.open(samplerate, self.channels, max(int(samplerate * self.block_seconds), 1), self.callback)
+        logging.info(f"Opened {self.sink_type} output: {samplerate}Hz, {self.channels} channels, {self.buffer_seconds}s buffer")
+
+
+    def close(self):
+        if self.sink is not None:
+            self.sink.close()
+            self.sink = None
+        self.clear()
+
+
+    async def prepare(self, samplerate: int):
+        """
+        按采样率打开设备，采样率变化时先等待已写入的音频播放完再重新打开
+        """
+        if self.sink is not None and self.samplerate == samplerate:
+            return
+        if self.sink is not None:
+            await self.mark()
+            self.close()
+        self.open(samplerate)
+
+
+    def callback(self, frames: int) -> np.ndarray:
+        """
+        声卡回调，在声卡线程中执行
+        """
+        out = np.empty((frames, self.channels), np.float32)
+        read = self.ring.read(out)
+        if read < frames and (self.writing or self.ring.read_pos < self.pending_position()):
+            self.underruns += 1
+        if read:
+            self.loop.call_soon_threadsafe(self.consumed, self.ring.read_pos)
+        return out
+
+
+    def pending_position(self) -> int:
+        try:
+            return self.markers[-1][0]
+        except IndexError:
+            return 0
+
+
+    def consumed(self, position: int):
+        """
+        声卡取走数据后在事件循环中执行，唤醒写入方并完成已播放到的结束位置
+        """
+        self.space.set()
+        while self.markers and self.markers[0][0] <= position:
+            _, future = self.markers.popleft()
+            if not future.done():
+                future.set_result(None)
+
+
+    def convert(self, pcm: np.ndarray) -> np.ndarray:
+        if pcm.ndim == 1:
+            pcm = pcm.reshape(-1, 1)
+        if pcm.shape[1] == self.channels:
+            return pcm
+        if self.channels == 1:
+            return pcm.mean(axis=1, keepdims=True, dtype=np.float32)
+        return np.repeat(pcm.mean(axis=1, keepdims=True, dtype=np.float32), self.channels, axis=1)
+
+
+    async def write(self, pcm: np.ndarray):
+        """
+        写入PCM数据，缓冲区满时等待声卡取走数据
+        """
+        pcm = self.convert(pcm)
+        while len(pcm):
+            pcm = pcm[self.ring.write(pcm):]
+            if len(pcm):
+                self.space.clear()
+                await self.space.wait()
+
+
+    def mark(self) -> asyncio.Future:
+        """
+        记录当前写入位置
+
+        Returns:
+            asyncio.Future: 声卡取走目前写入的所有帧时完成
+        """
+        future = self.loop.create_future()
+        position = self.ring.write_pos
+        if self.ring.read_pos >= position:
+            future.set_result(None)
+        else:
+            self.markers.append((position, future))
+        return future
+
+
+    def discard(self, start: int, end: int):
+        """
+        丢弃一段尚未播放的音频，并完成该段内的结束位置（打断单个会话时使用）
+
+        Args:
+            start: 该段的起始写入位置
+            end: 该段的结束写入位置
+        """
+        if self.ring is None:
+            return
+        self.ring.discard(start, end)
+        for marker in [marker for marker in self.markers if start < marker[0] <= end]:
+            self.markers.remove(marker)
+            if not marker[1].done():
+                marker[1].set_result(None)
+        self.space.set()
+
+
+    def clear(self):
+        """
+        丢弃所有尚未播放的音频（关闭设备时使用）
+        """
+        if self.ring is not None:
+            self.ring.clear()
+        while self.markers:
+            _, future = self.markers.popleft()
+            if not future.done():
+                future.set_result(None)
+        self.space.set()
+
+
+# 同一进程内所有会话共用一个输出设备
+_outputs: dict[str, PCMOutput] = {}
+
+
+def get_output(sink: str) -> PCMOutput:
+    if sink not in _outputs:
+        _outputs[sink] = PCMOutput(
+            sink=sink,
+            channels=config.get("channels", 1),
+            buffer=config.get("buffer", 0.5),
+            block=config.get("block", 0.02),
+            device=config.get("device"),
+        )
+    return _outputs[sink]
+
+
+class PCMPlayer:
+    """
+    基于PCM环形缓冲区的低延迟播放器
+
+    收到的PCM帧直接写入连续输出的设备，不等待上一句播放结束，句子之间无间隙。
+    sink为null时不需要声卡，以实时速度消费音频。
+    """
+    def __init__(self, sink: str = "pyaudio"):
+        self.output = get_output(sink)
+        # 本播放器写入的、可能尚未播放完的各段音频[start, end)，设备重新打开后失效
+        self.ring: PCMRingBuffer | None = None
+        self.regions: list[list[int]] = []
+
+
+    async def play(self, stream: AudioStream) -> asyncio.Future:
+        """
+        写入一句音频
+
+        Args:
+            stream: 要播放的音频流
+
+        Returns:
+            asyncio.Future: 该句最后一帧被声卡取走时完成
+        """
+        async with self.output.lock:
+            await self.output.prepare(stream.samplerate)
+            ring = self.output.ring
+            if self.ring is not ring:
+                self.ring = ring
+                self.regions = []
+            region = [ring.write_pos, ring.write_pos]
+            self.regions = [r for r in self.regions if r[1] > ring.read_pos]
+            self.regions.append(region)
+            self.output.writing = True
+            try:
+                async for pcm in stream:
+                    await self.output.write(pcm)
+                    region[1] = self.output.ring.write_pos
+            except Exception as e:
+                logging.error(f"Failed to play audio: {e}")
+            finally:
+                self.output.writing = False
+            return self.output.mark()
+
+
+    def clear(self):
+        """
+        丢弃本播放器尚未播放的音频，其他会话写入的音频不受影响
+        """
+        if self.ring is self.output.ring:
+            for start, end in reversed(self.regions):
+                self.output.discard(start, end)
+        self.regions.clear()
+
+
+    async def run(self, audio_queue: asyncio.Queue, start_time):
+        first_play = True
+        finished = None
+        underruns = self.output.underruns
+
+        try:
+            while True:
+                stream = await audio_queue.get()
+                if stream is None:
+                    break
+                if first_play:
+                    logging.info(f"First playing audio time: {time.time() - start_time:.2f}s")
+                    first_play = False
+                finished = await self.play(stream)
+                finished.add_done_callback(
+                    lambda _, sentence=stream.sentence: logging.info(f"Finished playing sentence: {sentence}")
+                )
+
+            if finished is not None:
+                await finished
+                logging.info(f"All audio played time: {time.time() - start_time:.2f}s")
+            if self.output.underruns > underruns:
+                logging.warning(f"Playback underruns: {self.output.underruns - underruns}")
+        except asyncio.CancelledError:
+            logging.info("Audio player cancelled")
+            self.clear()
+            raise
@@ -0,0 +1,186 @@
+"""
+会话管理模块
+
+该模块为每个对话会话维护独立的运行状态，使同一个后端进程可以同时服务多个数字人客户端：
+- 所有会话共享同一个GPT客户端，对话历史按会话ID保存在对话存储中
+- 每个会话拥有独立的TTS实例和播放器
+- 每个会话拥有独立的任务集合，取消操作只影响当前会话
+- 空闲会话按超时时间和最大会话数自动回收
+
+作者: 光明实验室媒体智能团队
+"""
+
+import time
+import asyncio
+from collections import OrderedDict
+
+from utils import Config, get_logger
+from utils.tokenizer import ChunkPolicy
+from services.gpt import GPT
+from services.tts import TTS
+from services.player import Player
+
+logging = get_logger()
+config = Config.get("Session", {}) or {}
+
+SESSION_HEADER = config.get("header", "X-Session-Id")
+DEFAULT_SESSION = config.get("default_id", "default")
+MAX_SESSIONS = config.get("max_sessions", 32)
+IDLE_TIMEOUT = config.get("idle_timeout", 1800)
+
+
+class Session:
+    """
+    单个对话会话
+
+    持有该会话的TTS、播放器实例以及所有正在运行的异步任务，
+    取消操作仅作用于本会话的任务。会话ID同时作为对话历史的键。
+    """
+    def __init__(self, session_id: str, socketio, gpt):
+        self.id = session_id
+        self.gpt = gpt
+        self.tts = TTS()
+        self.player = Player(socketio)
+        self.chunk_policy = ChunkPolicy()
+        # 最近一轮对话开始前的对话状态，撤销该轮时使用
+        self.snapshot = None
+        self.tasks: set[asyncio.Task] = set()
+        self.last_active = time.time()
+
+
+    @property
+    def busy(self) -> bool:
+        return any(not task.done() for task in self.tasks)
+
+
+    def touch(self):
+        self.last_active = time.time()
+
+
+    def create_task(self, coro) -> asyncio.Task:
+        """
+        在会话的取消范围内创建异步任务
+
+        Args:
+            coro: 要运行的协程
+
+        Returns:
+            asyncio.Task: 创建的任务，任务结束后自动从会话中移除
+        """
+        task = asyncio.create_task(coro)
+        self.add_task(task)
+        return task
+
+
+    def add_task(self, task: asyncio.Task):
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+
+    def cancel(self):
+        """
+        取消并清理本会话所有正在运行的异步任务
+        """
+        task: asyncio.Task
+        for task in list(self.tasks):
+            if not task.done():
+                task.cancel()
+        self.tasks.clear()
+
+
+class SessionManager:
+    """
+    会话管理器
+
+    按会话ID创建和查找会话，并回收长时间空闲的会话。
+    """
+    def __init__(self, socketio):
+        self.socketio = socketio
+        self.gpt = GPT()
+        self.sessions: OrderedDict[str, Session] = OrderedDict()
+
+
+    def get(self, session_id: str | None = None) -> Session:
+        """
+        获取会话，不存在时自动创建
+
+        Args:
+            session_id: 会话ID，为空时使用默认会话
+
+        Returns:
+            Session: 对应的会话对象
+        """
+        session_id = session_id or DEFAULT_SESSION
+
+        session = self.sessions.get(session_id)
+        if session is None:
+            self.evict()
+            session = Session(session_id, self.socketio, self.gpt)
+            self.sessions[session_id] = session
+            logging.info(f"Session created: {session_id} ({len(self.sessions)} active)")
+        else:
+            self.sessions.move_to_end(session_id)
+
+        session.touch()
+        return session
+
+
+    def cancel(self, session_id: str | None = None):
+        session = self.sessions.get(session_id or DEFAULT_SESSION)
+        if session is not None:
+            session.cancel()
+
+
+    def rollback(self, session_id: str | None = None):
+        """
+        取消会话正在进行的回复，并从对话历史中撤销最近一轮的用户消息和助手回复
+
+        用于投机提问被后续语音取代的情况，合并后的问题会重新提问。
+        """
+        session = self.sessions.get(session_id or DEFAULT_SESSION)
+        if session is None:
+            return
+        session.cancel()
+        if session.snapshot is not None:
+            self.gpt.restore(session.id, session.snapshot)
+            session.snapshot = None
+            logging.info(f"Last turn rolled back: {session.id}")
+
+
+    def reset(self, session_id: str | None = None):
+        """
+        取消会话正在进行的回复并清空其对话历史
+        """
+        session = self.get(session_id)
+        session.cancel()
+        session.snapshot = None
+        self.gpt.reset_body(session.id)
+
+
+    def cancel_all(self):
+        """
+        取消所有会话正在运行的任务，服务退出时调用
+        """
+        for session in self.sessions.values():
+            session.cancel()
+
+
+    def evict(self):
+        """
+        回收空闲会话
+
+        移除超过空闲时间且没有运行任务的会话；会话数仍超过上限时，
+        按最近最少使用顺序移除空闲会话。
+        """
+        now = time.time()
+        for session_id, session in list(self.sessions.items()):
+            if not session.busy and now - session.last_active > IDLE_TIMEOUT:
+                del self.sessions[session_id]
+                logging.info(f"Session expired: {session_id}")
+
+        for session_id, session in list(self.sessions.items()):
+            if len(self.sessions) < MAX_SESSIONS:
+                break
+            if not session.busy:
+                del self.sessions[session_id]
+                logging.info(f"Session evicted: {session_id}")
@@ -2,11 +2,13 @@ import os
 import copy
 import time
 from utils.httpx_client import httpx_client
-import aiofiles
 import random
 import string
 import asyncio
+from collections import deque
 from utils import get_logger, Config
+from utils.audio import AudioBuffer, AudioStream, WavStreamDecoder
+import numpy as np
 import yaml
 
 logging = get_logger()
@@ -20,9 +22,12 @@ if per_config is not None:
 
 class GPTSoVits:
     def __init__(self):
-        tmp_dir = f"{home_dir}/tmp"
-        if not os.path.exists(tmp_dir):
-            os.makedirs(tmp_dir)
+        # 调试模式下将每句合成的音频另存到tmp目录
+        self.debug_dump = config.get("debug_dump", False)
+        if self.debug_dump:
+            tmp_dir = f"{home_dir}/tmp"
+            if not os.path.exists(tmp_dir):
+                os.makedirs(tmp_dir)
             
         self.body = copy.deepcopy(config.get("request_body", {
             "ref_audio_path": "test.wav",
@@ -39,20 +44,31 @@ class GPTSoVits:
         self.headers = config.get("request_header", {
             "Content-Type": "application/json"
         })
+        
+        # 同时进行合成的句子数量、单次请求超时时间和失败重试次数
+        self.concurrency = max(config.get("concurrency", 2), 1)
+        self.timeout = config.get("timeout", 30)
+        self.retries = config.get("retries", 1)
+        # 边接收边解码WAV，合成完成前就开始播放
+        self.streaming = config.get("streaming", True)
             
     
-    async def generate(self, sentence: str, filename: str):
+    async def generate(self, sentence: str, stream: AudioStream):
         """
-        生成单个句子的音频文件
+        生成单个句子的音频
+        
+        开启流式播放时，从最先到达的字节中解析WAV头，之后每收到一段数据就把
+        解码出的PCM帧推入音频流；否则接收完整响应后再一次性推入。
         
         Args:
             sentence: 需要转换为语音的文本内容
-            filename: 保存音频文件的路径
+            stream: 接收PCM帧的音频流
             
         Raises:
             Exception: 当TTS服务请求失败时抛出
         """
-        self.body['text'] = sentence
+        body = dict(self.body)
+        body['text'] = sentence
         
         try: 
             # 记录开始时间
@@ -61,9 +77,9 @@ class GPTSoVits:
             async with httpx_client.stream(
                 "POST",
                 self.url,
-                json=self.body,
+                json=body,
                 headers=self.headers,
-                timeout=30
+                timeout=self.timeout
             ) as response:
                 # 记录首次收到响应时间
                 first_repsonse_time = time.time()
@@ -71,42 +87,160 @@ class GPTSoVits:
                 
                 response.raise_for_status()
                 
-                async with aiofiles.open(filename, "wb") as afp:
-                    async for chunk in response.aiter_bytes():
-                        await afp.write(chunk)
+                decoder = WavStreamDecoder() if self.streaming else None
+                data = bytearray()
+                dump = []
+                async for chunk in response.aiter_bytes():
+                    if decoder is None:
+                        data += chunk
+                        continue
+                    
+                    try:
+                        pcm = decoder.feed(chunk)
+                    except ValueError as e:
+                        # 不是可增量解码的WAV，退回到接收完整响应后再解码
+                        logging.warning(f"Progressive decoding unavailable, buffering response: {e}")
+                        data += decoder.buffer
+                        decoder = None
+                        continue
+                    
+                    if decoder.header_done and not stream.started:
+                        stream.start(decoder.samplerate, decoder.channels)
+                        logging.info(f"First audio frame time: {time.time() - start_time:.2f}s")
+                    if pcm is not None:
+                        stream.push(pcm)
+                        if self.debug_dump:
+                            dump.append(pcm)
                     
             # 记录所有数据接收完毕时间
             end_time = time.time()
             logging.info(f"All data received time: {end_time - first_repsonse_time:.2f}s")
             logging.info(f"All response time: {end_time - start_time:.2f}s")    
             
-            logging.info(f"Successfully generated audio file: {filename}")
+            if decoder is None:
+                audio = AudioBuffer.from_wav(bytes(data))
+                stream.start(audio.samplerate, audio.channels)
+                stream.push(audio.pcm)
+            elif not decoder.header_done:
+                raise ValueError("Incomplete WAV header")
+            else:
+                audio = AudioBuffer(pcm=np.concatenate(dump) if dump else np.zeros(0, np.float32), samplerate=stream.samplerate)
+            logging.info(f"Successfully generated audio: {stream.duration:.2f}s")
+            
+            if self.debug_dump:
+                filename = ''.join(random.sample(string.ascii_letters + string.digits, 16))
+                audio.save(f"{home_dir}/tmp/{filename}.wav")
                         
         except Exception as e:
             raise Exception(f"Failed to request TTS service: {e}")
         
         
-    async def audio_generate(self, sentence_stream):
+    async def synthesize(self, stream: AudioStream) -> float:
         """
-        从句子流中生成音频文件流
+        合成单个句子，超时或失败时按配置重试
         
-        为每个输入句子生成对应的音频文件，并返回文件路径
+        只有在还没有向音频流推入任何数据时才会重试，已经开始播放的句子失败后直接结束。
+        
+        Args:
+            stream: 待合成句子的音频流
+            
+        Returns:
+            float: 合成耗时（秒）
+            
+        Raises:
+            Exception: 重试次数用尽后仍然失败时抛出
+        """
+        start_time = time.time()
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    await asyncio.wait_for(self.generate(stream.sentence, stream), self.timeout)
+                    return time.time() - start_time
+                except Exception as e:
+                    if stream.started or attempt >= self.retries:
+                        stream.fail(e)
+                        raise
+                    logging.warning(f"TTS attempt {attempt + 1} failed, retrying: {e!r}")
+                    await asyncio.sleep(0.2 * (attempt + 1))
+        finally:
+            stream.finish()
+        
+        
+    async def audio_generate(self, sentence_stream, policy=None):
+        """
+        从句子流中生成音频流
+        
+        同时保持最多concurrency个句子在合成中，并严格按照句子顺序返回音频流。
+        每句的音频流在解析出WAV头后立即返回，播放器可以在该句合成完成前开始播放；
+        在返回前就失败的句子会被跳过。
         
         Args:
             sentence_stream: 输入句子的异步生成器
+            policy: 自适应分句策略，用于上报每句的合成耗时和音频时长
             
         Returns:
-            AsyncGenerator: 音频文件路径的异步生成器
+            AsyncGenerator: AudioStream的异步生成器
         """
-        index = 0
-        async for sentence in sentence_stream:
-            if sentence is None:
-                break
-            index += 1
-            filename = ''.join(random.sample(string.ascii_letters + string.digits, 16))
-            full_path = f"{home_dir}/tmp/" + filename + ".wav"
-            await self.generate(sentence, full_path)
-            yield full_path
+        sentences = sentence_stream.__aiter__()
+        next_sentence: asyncio.Future | None = None
+        reading = True
+        # 尚未返回的句子，以及已经返回但仍在合成中的句子
+        pending: deque[tuple[asyncio.Task, AudioStream]] = deque()
+        streaming: set[asyncio.Task] = set()
+        completed = False
+        
+        def report(task: asyncio.Task, stream: AudioStream):
+            if task.cancelled() or task.exception() is not None or policy is None:
+                return
+            synth_seconds = task.result()
+            policy.report(len(stream.sentence), stream.duration, synth_seconds)
+            logging.info(f"TTS real-time factor: {synth_seconds / stream.duration if stream.duration else 0:.2f}, audio lead: {policy.lead:.2f}s")
+        
+        try:
+            while True:
+                streaming = {task for task in streaming if not task.done()}
+                if reading and next_sentence is None and len(pending) + len(streaming) < self.concurrency:
+                    next_sentence = asyncio.ensure_future(anext(sentences, None))
+                    
+                waiters = [w for w in (next_sentence, pending[0][1].ready if pending else None) if w is not None]
+                if not waiters and not reading:
+                    break
+                # 合成中的句子占满并发数时只等待它们完成，之后再读取下一句
+                await asyncio.wait(waiters + list(streaming), return_when=asyncio.FIRST_COMPLETED)
+                
+                if next_sentence is not None and next_sentence.done():
+                    sentence = next_sentence.result()
+                    next_sentence = None
+                    if sentence is None:
+                        reading = False
+                    else:
+                        stream = AudioStream(sentence)
+                        task = asyncio.create_task(self.synthesize(stream))
+                        task.add_done_callback(lambda task, stream=stream: report(task, stream))
+                        pending.append((task, stream))
+                
+                while pending and pending[0][1].ready.done():
+                    task, stream = pending.popleft()
+                    if not stream.ready.result():
+                        logging.error(f"Failed to synthesize sentence, skipped: {stream.sentence}: {stream.error!r}")
+                        continue
+                    if not task.done():
+                        streaming.add(task)
+                    yield stream
+            
+            # 句子读完后等待已经返回的句子合成结束，否则最后几句的音频会被截断
+            if streaming:
+                await asyncio.gather(*streaming, return_exceptions=True)
+            completed = True
+        finally:
+            # 只有在提前关闭或被取消时才取消仍在合成的句子
+            if not completed:
+                if next_sentence is not None:
+                    next_sentence.cancel()
+                for task, _ in pending:
+                    task.cancel()
+                for task in streaming:
+                    task.cancel()
             
         yield None
 
@@ -115,15 +249,19 @@ class GPTSoVits:
         """
         音频生成器函数
         
-        从TTS服务获取生成的音频文件并放入队列中
+        从TTS服务获取生成的音频并放入队列中
         """
         try:
-            async for audio_file in audio_stream:
-                if audio_file is None:
+            async for audio in audio_stream:
+                if audio is None:
                     break
-                await audio_queue.put(audio_file)
-            await audio_queue.put(None)
+                await audio_queue.put(audio)
         except asyncio.CancelledError:
             logging.info("Audio generator cancelled")
-            await audio_queue.put(None)
             raise
+        except Exception as e:
+            # 错误同时通过输出流返回给调用方，这里只记录
+            logging.error(f"Audio generation failed: {e}")
+        finally:
+            # 上游出错时也要通知播放器结束，否则播放任务会一直等待
+            await audio_queue.put(None)
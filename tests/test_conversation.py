@@ -0,0 +1,36 @@
+"""
+对话历史撤销测试
+
+投机提问被合并后的问题取代时，撤销该轮的用户消息和部分回答。
+"""
+
+from services.gpt.openai import OpenAI
+
+
+def test_restore_removes_superseded_turn():
+    gpt = OpenAI()
+    gpt.set_body("你好", "s")
+    gpt.store.get("s").assistant_message = "你好，有什么可以帮你？"
+
+    snapshot = gpt.snapshot("s")
+    gpt.set_body("今天天气", "s")
+    gpt.store.get("s").assistant_message = "今天天气晴"
+    gpt.restore("s", snapshot)
+
+    body = gpt.set_body("今天天气怎么样", "s")
+    assert [(m["role"], m["content"]) for m in body["messages"][1:]] == [
+        ("user", "你好"),
+        ("assistant", "你好，有什么可以帮你？"),
+        ("user", "今天天气怎么样"),
+    ]
+
+
+def test_restore_first_turn():
+    gpt = OpenAI()
+    snapshot = gpt.snapshot("s")
+    gpt.set_body("今天天气", "s")
+    gpt.store.get("s").assistant_message = "今天"
+    gpt.restore("s", snapshot)
+
+    body = gpt.set_body("今天天气怎么样", "s")
+    assert [m["role"] for m in body["messages"]] == ["system", "user"]
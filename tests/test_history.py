@@ -0,0 +1,47 @@
+"""
+对话历史窗口测试
+"""
+
+from services.gpt.history import HistoryWindow
+
+
+def turns(count: int, size: int = 20) -> tuple[dict, ...]:
+    messages = [{"role": "system", "content": "系统"}]
+    for i in range(count):
+        messages.append({"role": "user", "content": f"问题{i}" + "问" * size})
+        messages.append({"role": "assistant", "content": f"回答{i}" + "答" * size})
+    messages.append({"role": "user", "content": "本轮问题"})
+    return tuple(messages)
+
+
+def test_summary_budget_not_reserved_without_eviction():
+    messages = turns(3)
+    total = sum(HistoryWindow().message_tokens(m) for m in messages)
+    window = HistoryWindow(max_tokens=total, summary=True, summary_tokens=100)
+    assert window.window(messages) == messages
+
+
+def test_summary_reserved_after_eviction():
+    messages = turns(10)
+    window = HistoryWindow(max_tokens=200, summary=True, summary_tokens=80)
+    result = window.window(messages)
+    assert result[1]["role"] == "system"
+    assert result[1]["content"].startswith("以下是较早对话的摘要：\n")
+    assert sum(window.message_tokens(m) for m in result) <= 200
+    assert result[-1]["content"] == "本轮问题"
+
+
+def test_long_excerpt_is_truncated():
+    messages = turns(10, size=200)
+    window = HistoryWindow(max_tokens=300, summary=True, summary_tokens=40)
+    summary = window.window(messages)[1]
+    lines = summary["content"].splitlines()
+    assert len(lines) == 2
+    assert window.message_tokens(summary) <= 40
+
+
+def test_no_header_only_summary():
+    messages = turns(10)
+    window = HistoryWindow(max_tokens=200, summary=True, summary_tokens=16)
+    result = window.window(messages)
+    assert all(not (m["content"] or "").startswith("以下是较早对话的摘要") for m in result)
@@ -0,0 +1,58 @@
+"""
+PCM播放器测试
+
+多个会话共用同一个输出时，打断一个会话只丢弃它自己尚未播放的音频。
+"""
+
+import asyncio
+
+import numpy as np
+
+from services.player.pcmplayer import PCMPlayer, PCMRingBuffer
+from utils.audio import AudioStream
+
+
+def make_stream(sentence: str, value: float, frames: int) -> AudioStream:
+    stream = AudioStream(sentence)
+    stream.start(16000, 1)
+    stream.push(np.full(frames, value, np.float32))
+    stream.finish()
+    return stream
+
+
+def test_ring_discard_tail_rewinds_write_position():
+    ring = PCMRingBuffer(8, 1)
+    ring.write(np.ones((3, 1), np.float32))
+    ring.write(np.full((3, 1), 2, np.float32))
+    ring.discard(3, 6)
+    assert ring.write_pos == 3
+
+
+def test_ring_discard_middle_fills_silence():
+    ring = PCMRingBuffer(8, 1)
+    ring.write(np.ones((6, 1), np.float32))
+    ring.read(np.empty((5, 1), np.float32))
+    ring.write(np.full((4, 1), 2, np.float32))
+    ring.discard(5, 6)
+    out = np.empty((5, 1), np.float32)
+    assert ring.read(out) == 5
+    assert out[:, 0].tolist() == [0, 2, 2, 2, 2]
+
+
+def test_cancel_keeps_other_session_audio():
+    async def main():
+        first, second = PCMPlayer("null"), PCMPlayer("null")
+        output = first.output
+        try:
+            await first.play(make_stream("a", 1, 2000))
+            finished = await second.play(make_stream("b", 2, 2000))
+            await first.play(make_stream("c", 1, 2000))
+            first.clear()
+            # 第一个会话最后一句位于缓冲区末尾被直接丢弃，第二个会话的音频不受影响
+            assert output.ring.write_pos == 4000
+            assert not finished.done()
+            await asyncio.wait_for(finished, 1)
+        finally:
+            output.close()
+
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+"""
+TTS音频流测试
+
+用模拟的TTS服务验证流式合成时每句的音频都完整送到播放端。
+"""
+
+import asyncio
+
+import numpy as np
+
+from services.tts.gptsovits import GPTSoVits
+from utils.audio import AudioStream
+
+CHUNKS = 8
+CHUNK_SIZE = 1000
+
+
+class MockTTS(GPTSoVits):
+    async def generate(self, sentence: str, stream: AudioStream):
+        stream.start(16000, 1)
+        for _ in range(CHUNKS):
+            await asyncio.sleep(0.005)
+            stream.push(np.zeros(CHUNK_SIZE, np.float32))
+
+
+async def sentences(items: list[str], delay: float):
+    for item in items:
+        if delay:
+            await asyncio.sleep(delay)
+        yield item
+    yield None
+
+
+async def play(items: list[str], delay: float) -> dict[str, int]:
+    """
+    模拟chat_stream中的TTS和播放任务，返回每句收到的采样数
+    """
+    tts = MockTTS()
+    audio_queue = asyncio.Queue()
+    received = {}
+
+    async def player():
+        while True:
+            stream = await audio_queue.get()
+            if stream is None:
+                break
+            received[stream.sentence] = 0
+            async for pcm in stream:
+                received[stream.sentence] += len(pcm)
+
+    sentence_stream = (item async for item in sentences(items, delay) if item is not None)
+    await asyncio.gather(tts.run(tts.audio_generate(sentence_stream), audio_queue), player())
+    return received
+
+
+def test_last_sentence_is_complete():
+    items = [f"第{i}句。" for i in range(5)]
+    received = asyncio.run(play(items, 0.01))
+    assert list(received) == items
+    assert received[items[-1]] == CHUNKS * CHUNK_SIZE
+    assert all(count == CHUNKS * CHUNK_SIZE for count in received.values())
+
+
+def test_sentences_arriving_at_once_are_complete():
+    items = [f"第{i}句。" for i in range(5)]
+    received = asyncio.run(play(items, 0))
+    assert all(count == CHUNKS * CHUNK_SIZE for count in received.values())
+
+
+def test_upstream_error_ends_playback():
+    async def failing():
+        yield "第0句。"
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream failed")
+
+    async def main():
+        tts = MockTTS()
+        audio_queue = asyncio.Queue()
+        await tts.run(tts.audio_generate(failing()), audio_queue)
+        items = []
+        while (item := audio_queue.get_nowait()) is not None:
+            items.append(item)
+        return items
+
+    items = asyncio.run(asyncio.wait_for(main(), 5))
+    assert [item.sentence for item in items] == ["第0句。"]
@@ -0,0 +1,97 @@
+"""
+FunASR批量识别工具
+
+并发识别录制的音频文件，输出每个文件的识别结果、整体吞吐量，
+提供参考文本时同时计算字错误率(CER)，用于回归测试识别准确率。
+
+用法:
+    python tools/asr_batch.py recordings/                       # 识别目录中的所有wav/pcm文件
+    python tools/asr_batch.py wav.scp --reference text.txt      # scp列表，参考文本每行“名称 文本”
+    python tools/asr_batch.py a.wav b.wav -c 8 -o result.jsonl  # 8个连接并发，结果保存为jsonl
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.asr.batch import BatchTranscriber, read_list
+
+
+def load_reference(path: str) -> dict[str, str]:
+    reference = {}
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            parts = line.strip().split(maxsplit=1)
+            if parts:
+                reference[parts[0]] = parts[1] if len(parts) > 1 else ""
+    return reference
+
+
+def normalize(text: str) -> str:
+    """去掉空白和标点，只比较文字"""
+    return "".join(char for char in text if char.isalnum())
+
+
+def edit_distance(a: str, b: str) -> int:
+    previous = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        current = [i]
+        for j, y in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (x != y)))
+        previous = current
+    return previous[-1]
+
+
+async def main(args):
+    items = [item for path in args.inputs for item in read_list(path)]
+    if not items:
+        print("No audio files found")
+        return
+
+    transcriber = BatchTranscriber(connections=args.connections, mode=args.mode)
+    print(f"Transcribing {len(items)} files over {min(transcriber.connections, len(items))} connections ({transcriber.client.mode})")
+
+    def progress(result):
+        status = f"ERROR {result.error}" if result.error else result.text
+        print(f"{result.name}\t{result.elapsed:.2f}s\t{status}")
+
+    start = time.monotonic()
+    results = await transcriber.transcribe(items, progress)
+    elapsed = time.monotonic() - start
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            for result in results:
+                file.write(json.dumps(result.to_dict(), ensure_ascii=False) + "\n")
+
+    audio = sum(result.duration for result in results)
+    failed = sum(1 for result in results if result.error)
+    print(f"Files: {len(results)}, failed: {failed}")
+    print(f"Audio: {audio:.1f}s, wall time: {elapsed:.1f}s, throughput: {audio / elapsed if elapsed else 0:.1f}x realtime")
+
+    if args.reference:
+        reference = load_reference(args.reference)
+        errors = total = 0
+        for result in results:
+            if result.error or result.name not in reference:
+                continue
+            expected = normalize(reference[result.name])
+            errors += edit_distance(normalize(result.text), expected)
+            total += len(expected)
+        if total:
+            print(f"CER: {errors / total:.2%} ({errors}/{total})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FunASR batch transcription")
+    parser.add_argument("inputs", nargs="+", help="wav/pcm files, directories or scp lists")
+    parser.add_argument("-c", "--connections", type=int, default=None, help="number of websocket connections")
+    parser.add_argument("-m", "--mode", type=str, default=None, help="offline, online, 2pass")
+    parser.add_argument("-o", "--output", type=str, default=None, help="write results as jsonl")
+    parser.add_argument("-r", "--reference", type=str, default=None, help="reference text, one 'name text' per line")
+    asyncio.run(main(parser.parse_args()))
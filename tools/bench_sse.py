@@ -0,0 +1,113 @@
+"""
+SSE解析微基准测试
+
+回放录制的GPT流式响应（或生成的模拟响应），按固定大小切块后分别交给
+原先的split解析方式和增量SSEDecoder，比较两者的解析耗时。
+
+用法:
+    python tools/bench_sse.py                       # 使用模拟的OpenAI流
+    python tools/bench_sse.py --record stream.txt   # 回放录制的原始响应体
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.sse import SSEDecoder, DONE
+
+
+def make_stream(events: int, newline: bytes = b"\n") -> bytes:
+    """生成模拟的OpenAI流式响应体"""
+    lines = []
+    for i in range(events):
+        payload = json.dumps({
+            "id": "chatcmpl-bench",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": "bench",
+            "choices": [{"index": 0, "delta": {"content": f"第{i}个词，"}, "finish_reason": None}]
+        }, ensure_ascii=False).encode("utf-8")
+        lines.append(b"data: " + payload + newline + newline)
+    lines.append(b"data: [DONE]" + newline + newline)
+    return b"".join(lines)
+
+
+def split_chunks(data: bytes, chunk_size: int) -> list[bytes]:
+    return [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+
+def legacy_parse(chunks: list[bytes]) -> int:
+    """原先create_text_stream中的解析方式"""
+    count = 0
+    buffer = b""
+    split_bytes = b""
+    for chunk in chunks:
+        buffer += chunk
+        if b"\r\n\r\n" in buffer:
+            split_bytes = b"\r\n\r\n"
+        elif b"\n\n" in buffer:
+            split_bytes = b"\n\n"
+        else:
+            continue
+        while split_bytes in buffer:
+            line, buffer = buffer.split(split_bytes, 1)
+            text = line.decode("utf-8")
+            if "data:" in text:
+                text = text.split("data:")[1].strip()
+                if text == "[DONE]":
+                    break
+                json.loads(text)
+                count += 1
+    return count
+
+
+def decoder_parse(chunks: list[bytes]) -> int:
+    import orjson
+    count = 0
+    decoder = SSEDecoder()
+    for chunk in chunks:
+        for data in decoder.feed(chunk):
+            if data == DONE:
+                return count
+            orjson.loads(data)
+            count += 1
+    return count
+
+
+def bench(name: str, func, chunks: list[bytes], repeat: int) -> float:
+    func(chunks)
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        events = func(chunks)
+    elapsed = (time.perf_counter() - start_time) / repeat
+    print(f"  {name:<10} {elapsed * 1000:8.3f} ms  ({events} events)")
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark SSE stream parsing')
+    parser.add_argument('--record', help='Path to a recorded raw GPT response body')
+    parser.add_argument('--events', type=int, default=2000, help='Number of events in the simulated stream')
+    parser.add_argument('--crlf', action='store_true', help='Use \\r\\n line endings in the simulated stream')
+    parser.add_argument('--chunk-sizes', default='64,1024,65536', help='Comma separated replay chunk sizes')
+    parser.add_argument('--repeat', type=int, default=20, help='Repetitions per measurement')
+
+    args = parser.parse_args()
+
+    if args.record:
+        with open(args.record, 'rb') as file:
+            data = file.read()
+    else:
+        data = make_stream(args.events, b"\r\n" if args.crlf else b"\n")
+    print(f"Stream size: {len(data)} bytes")
+
+    for chunk_size in [int(x) for x in args.chunk_sizes.split(",")]:
+        chunks = split_chunks(data, chunk_size)
+        print(f"Chunk size {chunk_size} ({len(chunks)} chunks):")
+        legacy = bench("legacy", legacy_parse, chunks, args.repeat)
+        decoder = bench("decoder", decoder_parse, chunks, args.repeat)
+        print(f"  speedup    {legacy / decoder:8.2f}x")
@@ -0,0 +1,31 @@
+"""
+RAG索引构建工具
+
+读取configs/rag/data中的问答，增量更新向量索引并报告耗时，
+适合在导入大型FAQ表格（tools/excel_to_json.py）后、启动服务之前预先计算向量。
+中断或部分批次失败后重新运行，会从检查点继续计算剩余的问答。
+
+用法:
+    python tools/build_rag_index.py
+"""
+
+import os
+import sys
+import time
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.gpt.rag import load_docs_from_json, load_vectorstore, index_dir
+
+
+async def main():
+    start = time.time()
+    documents = load_docs_from_json()
+    vectorstore = await load_vectorstore(documents)
+    elapsed = time.time() - start
+    print(f"Indexed {vectorstore.index.ntotal} documents in {elapsed:.1f}s ({index_dir})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,5 +1,6 @@
 from .config import Config, Prompt, Template
 from .httpx_client import httpx_client
-from .itertools import atee
 from .logs import get_logger
+from .itertools import atee
 from .tokenizer import sentence_segment
+from .sse import SSEDecoder, aiter_sse
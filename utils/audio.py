@@ -0,0 +1,309 @@
+"""
+音频数据模块
+
+该模块定义在TTS、播放器和Audio2Face之间传递的内存音频格式，
+音频以float32 PCM和采样率的形式保存，整个链路无需读写临时文件。
+AudioStream用于在合成完成前把已经收到的PCM帧交给播放器。
+
+作者: 光明实验室媒体智能团队
+"""
+
+import io
+import asyncio
+from dataclasses import dataclass
+
+import numpy as np
+import soundfile
+
+
+@dataclass(slots=True)
+class AudioBuffer:
+    """
+    内存中的一段音频
+
+    Attributes:
+        pcm: float32 PCM数据，单声道为一维数组，多声道为(帧数, 声道数)的二维数组
+        samplerate: 采样率
+    """
+    pcm: np.ndarray
+    samplerate: int
+
+
+    @property
+    def channels(self) -> int:
+        return 1 if self.pcm.ndim == 1 else self.pcm.shape[1]
+
+
+    @property
+    def duration(self) -> float:
+        return len(self.pcm) / self.samplerate if self.samplerate else 0.0
+
+
+    @classmethod
+    def from_wav(cls, data: bytes) -> "AudioBuffer":
+        """
+        从WAV等音频文件内容解码
+
+        Args:
+            data: 完整的音频文件字节
+
+        Returns:
+            AudioBuffer: 解码后的音频
+        """
+        pcm, samplerate = soundfile.read(io.BytesIO(data), dtype="float32")
+        return cls(pcm=pcm, samplerate=samplerate)
+
+
+    def mono(self) -> np.ndarray:
+        return self.pcm if self.pcm.ndim == 1 else self.pcm.mean(axis=1, dtype=np.float32)
+
+
+    def to_wav(self, subtype: str = "PCM_16") -> bytes:
+        """
+        编码为WAV文件内容
+        """
+        bio = io.BytesIO()
+        soundfile.write(bio, self.pcm, self.samplerate, subtype=subtype, format="WAV")
+        return bio.getvalue()
+
+
+    def save(self, filename: str):
+        soundfile.write(filename, self.pcm, self.samplerate)
+
+
+class WavStreamDecoder:
+    """
+    增量WAV解码器
+
+    从最先到达的字节中解析RIFF头（fmt和data块），之后每次喂入的数据立即解码为PCM帧，
+    不完整的帧留到下一次拼接。流式TTS服务常把data块长度写成0或0xFFFFFFFF，
+    此时data块之后的所有数据都视为PCM。
+    """
+    # (格式编号, 位深) -> 解码函数
+    FORMATS = {
+        (1, 8): lambda raw: (np.frombuffer(raw, np.uint8).astype(np.float32) - 128) / 128,
+        (1, 16): lambda raw: np.frombuffer(raw, "<i2").astype(np.float32) / 32768,
+        (1, 24): lambda raw: _decode_pcm24(raw),
+        (1, 32): lambda raw: (np.frombuffer(raw, "<i4") / 2147483648).astype(np.float32),
+        (3, 32): lambda raw: np.frombuffer(raw, "<f4").astype(np.float32),
+        (3, 64): lambda raw: np.frombuffer(raw, "<f8").astype(np.float32),
+    }
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.header_done = False
+        self.samplerate = 0
+        self.channels = 1
+        self.block_align = 0
+        self.decode = None
+        self.remaining: int | None = None
+
+
+    def parse_header(self) -> bool:
+        """
+        尝试从缓冲区解析WAV头
+
+        Returns:
+            bool: 头部是否已完整解析
+
+        Raises:
+            ValueError: 数据不是支持的WAV格式
+        """
+        buffer = self.buffer
+        if len(buffer) < 12:
+            return False
+        if buffer[:4] != b"RIFF" or buffer[8:12] != b"WAVE":
+            raise ValueError("Not a RIFF/WAVE stream")
+
+        offset = 12
+        while len(buffer) >= offset + 8:
+            chunk_id = bytes(buffer[offset:offset + 4])
+            size = int.from_bytes(buffer[offset + 4:offset + 8], "little")
+            body = offset + 8
+
+            if chunk_id == b"data":
+                if self.decode is None:
+                    raise ValueError("WAV data chunk before fmt chunk")
+                self.remaining = None if size in (0, 0xFFFFFFFF) else size
+                del buffer[:body]
+                self.header_done = True
+                return True
+
+            if len(buffer) < body + size:
+                return False
+            if chunk_id == b"fmt ":
+                self.parse_format(bytes(buffer[body:body + size]))
+            offset = body + size + (size & 1)
+        return False
+
+
+    def parse_format(self, fmt: bytes):
+        audio_format = int.from_bytes(fmt[0:2], "little")
+        self.channels = int.from_bytes(fmt[2:4], "little")
+        self.samplerate = int.from_bytes(fmt[4:8], "little")
+        self.block_align = int.from_bytes(fmt[12:14], "little")
+        bits = int.from_bytes(fmt[14:16], "little")
+        if audio_format == 0xFFFE and len(fmt) >= 26:
+            # WAVE_FORMAT_EXTENSIBLE的实际格式在子格式GUID的前两个字节
+            audio_format = int.from_bytes(fmt[24:26], "little")
+
+        self.decode = self.FORMATS.get((audio_format, bits))
+        if self.decode is None or not self.channels or not self.block_align:
+            raise ValueError(f"Unsupported WAV format: format={audio_format}, bits={bits}")
+
+
+    def feed(self, data: bytes) -> np.ndarray | None:
+        """
+        喂入新到达的字节
+
+        Args:
+            data: 响应体中的一段数据
+
+        Returns:
+            np.ndarray | None: 本次可以解码出的PCM帧，头部未解析完或不足一帧时返回None
+
+        Raises:
+            ValueError: 数据不是支持的WAV格式
+        """
+        self.buffer += data
+        if not self.header_done and not self.parse_header():
+            return None
+
+        available = len(self.buffer)
+        if self.remaining is not None:
+            available = min(available, self.remaining)
+        length = available - available % self.block_align
+        if not length:
+            return None
+
+        raw = bytes(self.buffer[:length])
+        del self.buffer[:length]
+        if self.remaining is not None:
+            self.remaining -= length
+            if self.remaining == 0:
+                # data块之后的其他块不属于音频
+                self.buffer.clear()
+
+        pcm = self.decode(raw)
+        return pcm if self.channels == 1 else pcm.reshape(-1, self.channels)
+
+
+def _decode_pcm24(raw: bytes) -> np.ndarray:
+    data = np.frombuffer(raw, np.uint8).reshape(-1, 3)
+    value = data[:, 0].astype(np.int32) | (data[:, 1].astype(np.int32) << 8) | (data[:, 2].astype(np.int8).astype(np.int32) << 16)
+    return value.astype(np.float32) / 8388608
+
+
+class AudioStream:
+    """
+    边合成边播放的单句音频流
+
+    TTS解析出采样率后调用start，之后每收到一段PCM就调用push，播放器可以在合成
+    完成前开始消费。ready在头部解析完成（True）或合成失败（False）时完成。
+    同一个流只能被一个播放器消费。
+    """
+    def __init__(self, sentence: str = ""):
+        self.sentence = sentence
+        self.samplerate = 0
+        self.channels = 1
+        self.frames = 0
+        self.error: BaseException | None = None
+        self.finished = False
+        self.ready: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.chunks: asyncio.Queue = asyncio.Queue()
+
+
+    @property
+    def started(self) -> bool:
+        return self.ready.done() and self.ready.result()
+
+
+    @property
+    def duration(self) -> float:
+        """目前已收到的音频时长（秒）"""
+        return self.frames / self.samplerate if self.samplerate else 0.0
+
+
+    def start(self, samplerate: int, channels: int = 1):
+        self.samplerate = samplerate
+        self.channels = channels
+        if not self.ready.done():
+            self.ready.set_result(True)
+
+
+    def push(self, pcm: np.ndarray):
+        if len(pcm):
+            self.frames += len(pcm)
+            self.chunks.put_nowait(pcm)
+
+
+    def finish(self):
+        """
+        结束音频流，可以重复调用；头部解析前结束时ready返回False
+        """
+        if self.finished:
+            return
+        self.finished = True
+        if not self.ready.done():
+            self.ready.set_result(False)
+        self.chunks.put_nowait(None)
+
+
+    def fail(self, error: BaseException):
+        """
+        合成失败，头部解析前失败时ready返回False，之后失败时消费端收到异常
+        """
+        if self.finished:
+            return
+        self.error = error
+        self.finish()
+
+
+    async def __aiter__(self):
+        while True:
+            pcm = await self.chunks.get()
+            if pcm is None:
+                break
+            yield pcm
+        if self.error is not None and self.frames:
+            raise self.error
+
+
+    async def read(self) -> AudioBuffer:
+        """
+        等待合成完成并返回完整音频
+        """
+        chunks = [pcm async for pcm in self]
+        pcm = np.concatenate(chunks) if chunks else np.zeros(0, np.float32)
+        return AudioBuffer(pcm=pcm, samplerate=self.samplerate)
+
+
+class Resampler:
+    """
+    流式线性插值重采样
+
+    跨数据块保留上一块的最后一个采样和插值相位，分块处理的结果与整段处理一致。
+    只处理单声道数据。
+    """
+    def __init__(self, source_rate: int, target_rate: int):
+        self.source_rate = source_rate
+        self.target_rate = target_rate
+        self.step = source_rate / target_rate
+        self.position = 0.0
+        self.tail: np.ndarray | None = None
+
+
+    def process(self, pcm: np.ndarray) -> np.ndarray:
+        if self.source_rate == self.target_rate or not len(pcm):
+            return pcm
+
+        x = pcm if self.tail is None else np.concatenate((self.tail, pcm))
+        last = len(x) - 1
+        count = max(int(np.floor((last - self.position) / self.step)) + 1, 0)
+        positions = self.position + self.step * np.arange(count)
+        out = np.interp(positions, np.arange(len(x)), x).astype(np.float32)
+
+        # 下一块的坐标从本块最后一个采样开始
+        self.position = self.position + self.step * count - last
+        self.tail = x[-1:]
+        return out
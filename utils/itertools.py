@@ -7,54 +7,238 @@
 作者: 光明实验室媒体智能团队
 """
 
+import pickle
 import asyncio
+import tempfile
+from collections import deque
 
+from utils import get_logger
 
-async def atee(async_generator):
+logging = get_logger()
+
+POLICIES = ("block", "drop-oldest", "spill")
+
+_END = object()
+
+
+class _Raise:
+    """源生成器抛出的异常，传递给每个分流后在消费端重新抛出"""
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+
+class _Spill:
+    """
+    分流缓冲区的磁盘溢出区
+
+    缓冲区已满时，后续数据按顺序序列化到临时文件中，消费者读空缓冲区后再依次读回。
+    """
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.read_pos = 0
+        self.count = 0
+
+
+    def __len__(self) -> int:
+        return self.count
+
+
+    def append(self, item):
+        self.file.seek(0, 2)
+        pickle.dump(item, self.file, pickle.HIGHEST_PROTOCOL)
+        self.count += 1
+
+
+    def popleft(self):
+        self.file.seek(self.read_pos)
+        item = pickle.load(self.file)
+        self.read_pos = self.file.tell()
+        self.count -= 1
+        if self.count == 0:
+            self.file.seek(0)
+            self.file.truncate()
+            self.read_pos = 0
+        return item
+
+
+    def close(self):
+        self.file.close()
+
+
+class _Branch:
+    """
+    单个分流的有界缓冲区
+
+    缓冲区满时按策略处理新数据：
+    - block: 等待消费者取走数据，源数据的读取随之暂停
+    - drop-oldest: 丢弃最早的未消费数据
+    - spill: 将新数据溢出到临时文件
+    结束标记和异常不受缓冲区大小限制，保证一定能送达消费者。
+    """
+    def __init__(self, maxsize: int, policy: str):
+        self.maxsize = maxsize
+        self.policy = policy
+        self.items = deque()
+        self.spill: _Spill | None = None
+        self.final = None
+        self.closed = False
+        self.dropped = 0
+        self.readable = asyncio.Event()
+        self.writable = asyncio.Event()
+        self.writable.set()
+
+
+    def full(self) -> bool:
+        return self.maxsize > 0 and len(self.items) >= self.maxsize
+
+
+    async def put(self, item):
+        if self.closed:
+            return
+
+        if self.spill:
+            self.spill.append(item)
+            return
+
+        if self.full():
+            if self.policy == "block":
+                while self.full() and not self.closed:
+                    self.writable.clear()
+                    await self.writable.wait()
+                if self.closed:
+                    return
+            elif self.policy == "drop-oldest":
+                self.items.popleft()
+                self.dropped += 1
+            else:
+                if self.spill is None:
+                    self.spill = _Spill()
+                self.spill.append(item)
+                return
+
+        self.items.append(item)
+        self.readable.set()
+
+
+    def finish(self, marker):
+        """
+        写入结束标记或异常，不受缓冲区大小限制
+        """
+        if self.closed:
+            return
+        if self.spill:
+            self.final = marker
+        else:
+            self.items.append(marker)
+        self.readable.set()
+
+
+    async def get(self):
+        while not self.items:
+            self.readable.clear()
+            await self.readable.wait()
+
+        item = self.items.popleft()
+
+        if self.spill is not None:
+            while self.spill and not self.full():
+                self.items.append(self.spill.popleft())
+            if not self.spill and self.final is not None:
+                self.items.append(self.final)
+                self.final = None
+
+        self.writable.set()
+        return item
+
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.items.clear()
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+        if self.dropped:
+            logging.warning(f"atee branch dropped {self.dropped} items")
+        self.writable.set()
+
+
+async def atee(async_generator, n: int = 2, maxsize: int = 0, policy: str = "block"):
     """
-    将一个异步生成器分流成两个独立的异步生成器
-    
-    类似于Unix系统中的tee命令，将一个数据流分成两个相同的流，
+    将一个异步生成器分流成多个独立的异步生成器
+
+    类似于Unix系统中的tee命令，将一个数据流分成多个相同的流，
     以便不同的消费者可以同时处理相同的数据流而不相互影响。
-    
+    源生成器结束、出错或被取消时，所有分流都会收到结束信号或重新抛出异常；
+    所有消费者都退出后，读取源生成器的任务会被取消。
+
     Args:
         async_generator: 源异步生成器
-        
+        n: 分流的数量
+        maxsize: 每个分流的缓冲区大小，0表示不限制
+        policy: 缓冲区满时的处理策略 (block, drop-oldest, spill)
+
     Returns:
-        tuple: 包含两个异步生成器和一个任务对象的元组
-            - 第一个异步生成器，会产生与源生成器相同的数据
-            - 第二个异步生成器，会产生与源生成器相同的数据
+        tuple: 包含n个异步生成器和一个任务对象的元组
+            - n个异步生成器，每个都会产生与源生成器相同的数据
             - 负责填充队列的异步任务，可用于监控或取消操作
     """
-    queue1 = asyncio.Queue()
-    queue2 = asyncio.Queue()
+    if policy not in POLICIES:
+        raise ValueError(f"Invalid atee policy: {policy}")
+
+    branches = [_Branch(maxsize, policy) for _ in range(n)]
 
     async def populate_queues():
         """
-        从源生成器读取数据并填充两个队列
-        
-        当源生成器结束时，向两个队列发送None以表示结束
+        从源生成器读取数据并填充所有分流
+
+        当源生成器结束或被取消时，向所有分流发送结束标记；出错时发送异常
         """
-        async for item in async_generator:
-            await queue1.put(item)
-            await queue2.put(item)
+        marker = _END
+        try:
+            async for item in async_generator:
+                if item is None:
+                    break
+                for branch in branches:
+                    await branch.put(item)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            marker = _Raise(e)
+        finally:
+            for branch in branches:
+                branch.finish(marker)
+            aclose = getattr(async_generator, "aclose", None)
+            if aclose is not None:
+                await aclose()
 
     task = asyncio.create_task(populate_queues())
 
-    async def get_from_queue(queue):
+    async def get_from_queue(branch: _Branch):
         """
-        从队列中读取数据并产生为异步生成器
-        
+        从分流中读取数据并产生为异步生成器
+
         Args:
-            queue: 要读取的asyncio队列
-            
+            branch: 要读取的分流
+
         Yields:
-            从队列中获取的数据项，直到遇到None
+            从分流中获取的数据项，直到遇到结束标记
+
+        Raises:
+            Exception: 源生成器抛出的异常
         """
-        while True:
-            item = await queue.get()
-            if item is None:
-                break
-            yield item
+        try:
+            while True:
+                item = await branch.get()
+                if item is _END:
+                    break
+                if isinstance(item, _Raise):
+                    raise item.exception
+                yield item
+        finally:
+            branch.close()
+            if all(b.closed for b in branches) and not task.done():
+                task.cancel()
 
-    return get_from_queue(queue1), get_from_queue(queue2), task
+    return *(get_from_queue(branch) for branch in branches), task
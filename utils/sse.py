@@ -0,0 +1,107 @@
+"""
+SSE流解析模块
+
+该模块提供增量式的Server-Sent Events解码器，用于解析大语言模型返回的流式响应：
+- 使用bytearray缓存未完成的行，每个字节只扫描一次
+- 兼容\\n和\\r\\n换行，支持多行data字段和注释行
+- 识别[DONE]结束标记
+
+作者: 光明实验室媒体智能团队
+"""
+
+DONE = b"[DONE]"
+
+
+class SSEDecoder:
+    """
+    增量SSE解码器
+
+    每次喂入新的字节块，返回其中已完整接收的事件数据。
+    未完成的行保留在缓冲区中，下次只从新到达的字节开始查找换行符。
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+        self.scan = 0
+        self.data: list[bytes] = []
+
+
+    def feed(self, chunk: bytes) -> list[bytes]:
+        """
+        解析新到达的字节块
+
+        Args:
+            chunk: 新收到的字节数据
+
+        Returns:
+            list[bytes]: 本次完成的所有事件的data内容，多行data以换行符连接
+        """
+        buffer = self.buffer
+        buffer += chunk
+
+        events = []
+        start = 0
+        while True:
+            end = buffer.find(b"\n", self.scan)
+            if end == -1:
+                break
+            self.scan = end + 1
+
+            line = buffer[start:end]
+            start = end + 1
+            if line.endswith(b"\r"):
+                line = line[:-1]
+
+            if not line:
+                if self.data:
+                    events.append(b"\n".join(self.data))
+                    self.data = []
+                continue
+            if line.startswith(b":"):
+                continue
+
+            field, _, value = line.partition(b":")
+            if field == b"data":
+                if value.startswith(b" "):
+                    value = value[1:]
+                self.data.append(bytes(value))
+
+        if start:
+            del buffer[:start]
+            self.scan -= start
+
+        return events
+
+
+    def flush(self) -> list[bytes]:
+        """
+        结束解析，返回流末尾未以空行结束的事件
+        """
+        events = self.feed(b"\n\n") if self.buffer or self.data else []
+        self.buffer.clear()
+        self.scan = 0
+        return events
+
+
+async def aiter_sse(byte_stream):
+    """
+    将字节流解析为SSE事件数据流
+
+    Args:
+        byte_stream: 字节数据的异步生成器，产生None时视为结束
+
+    Yields:
+        bytes: 每个事件的data内容，遇到[DONE]时结束
+    """
+    decoder = SSEDecoder()
+    async for chunk in byte_stream:
+        if chunk is None:
+            break
+        for data in decoder.feed(chunk):
+            if data == DONE:
+                return
+            yield data
+
+    for data in decoder.flush():
+        if data == DONE:
+            return
+        yield data
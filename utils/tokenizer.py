@@ -7,45 +7,289 @@
 作者: 光明实验室媒体智能团队
 """
 
-from utils import get_logger
+import re
+import time
+
+from utils import Config, get_logger
 
 logging = get_logger()
+config = Config.get("Segment", {}) or {}
+
+# 连续的标点视为一个断句点（如省略号），紧随其后的右引号和右括号归入前一句
+PUNCTUATION = re.compile(r"[,.?!:;\-，。？！：；、…]+[\"'”’」』》）)\]]*")
+
+WORD_BEFORE = re.compile(r"[A-Za-z.]*$")
+
+ABBREVIATIONS = frozenset({
+    "mr", "mrs", "ms", "dr", "prof", "sr", "jr", "st", "vs", "etc",
+    "e.g", "i.e", "inc", "ltd", "co", "no", "fig", "u.s", "a.m", "p.m",
+})
+
+# 出现在文本末尾时可以立即断句的标点，其余标点要等下一个字符到达后才能确定
+# （小数点、缩写、省略号、句末的右引号等）
+IMMEDIATE = "，、；"
+
+
+class AdaptiveChunkPolicy:
+    """
+    自适应分句策略
+
+    第一句使用很短的最小长度，尽快开始合成和播放；之后根据实测的TTS实时率
+    (合成耗时/音频时长)和已合成但尚未播放完的音频时长(领先量)，
+    计算下一句在当前领先量耗尽前能够合成完成的最大长度，领先量越大句子越长。
+    """
+    def __init__(
+        self,
+        first_min_length: int = 4,
+        first_max_length: int = 12,
+        min_length: int = 20,
+        max_length: int = 80,
+        safety: float = 1.5,
+        smoothing: float = 0.3,
+    ):
+        self.first_min_length = first_min_length
+        self.first_max_length = first_max_length
+        self.default_min_length = min_length
+        self.max_length = max_length
+        self.safety = safety
+        self.smoothing = smoothing
+        # 跨轮次保留的实测值
+        self.rtf: float | None = None
+        self.seconds_per_char: float | None = None
+        self.start()
+
+
+    def start(self):
+        """
+        开始新一轮回复，清空领先量统计
+        """
+        self.audio_seconds = 0.0
+        self.play_start: float | None = None
+
+
+    def average(self, old: float | None, new: float) -> float:
+        return new if old is None else old + self.smoothing * (new - old)
+
+
+    def report(self, text_length: int, audio_seconds: float, synth_seconds: float):
+        """
+        上报一句话的合成结果
+
+        Args:
+            text_length: 句子长度
+            audio_seconds: 合成音频的时长
+            synth_seconds: 合成耗时
+        """
+        if audio_seconds <= 0 or text_length <= 0:
+            return
+        self.rtf = self.average(self.rtf, synth_seconds / audio_seconds)
+        self.seconds_per_char = self.average(self.seconds_per_char, audio_seconds / text_length)
+
+        if self.play_start is None:
+            self.play_start = time.monotonic()
+        self.audio_seconds += audio_seconds
+
+
+    @property
+    def lead(self) -> float:
+        """已合成但尚未播放的音频时长（秒）"""
+        if self.play_start is None:
+            return 0.0
+        return max(self.audio_seconds - (time.monotonic() - self.play_start), 0.0)
+
+
+    def min_length_for(self, emitted: int) -> int:
+        if emitted == 0:
+            return self.first_min_length
+        if self.rtf is None or self.seconds_per_char is None:
+            return self.default_min_length
+
+        synth_per_char = self.rtf * self.seconds_per_char * self.safety
+        if synth_per_char <= 0:
+            return self.max_length
+        affordable = int(self.lead / synth_per_char)
+        return min(max(affordable, self.first_min_length), self.max_length)
+
+
+    def max_length_for(self, emitted: int) -> int:
+        return self.first_max_length if emitted == 0 else self.max_length
+
+
+def ChunkPolicy():
+    if not config.get("adaptive", False):
+        return None
+    return AdaptiveChunkPolicy(
+        first_min_length=config.get("first_min_length") or 4,
+        first_max_length=config.get("first_max_length", 12),
+        min_length=config.get("min_length", 20),
+        max_length=config.get("max_length", 80),
+        safety=config.get("safety", 1.5),
+    )
+
+
+class SentenceSegmenter:
+    """
+    流式句子分割器
+
+    每次只扫描新追加的文本查找断句点，累积文本达到最小长度后在最后一个断句点处切分，
+    超过最大长度仍没有断句点时强制切分。
+    可以为第一句设置更短的最小长度，尽早开始语音合成；
+    指定分句策略时，最小和最大长度由策略动态决定。
+    """
+    def __init__(
+        self,
+        min_length: int = 20,
+        max_length: int = 80,
+        first_min_length: int | None = None,
+        policy: AdaptiveChunkPolicy | None = None,
+    ):
+        self.min_length = min_length
+        self.max_length = max_length
+        self.first_min_length = first_min_length or min_length
+        self.policy = policy
+        self.buffer = ""
+        self.scan = 0
+        self.boundary = 0
+        self.emitted = 0
+
+
+    @property
+    def current_min_length(self) -> int:
+        if self.policy is not None:
+            return self.policy.min_length_for(self.emitted)
+        return self.first_min_length if self.emitted == 0 else self.min_length
+
+
+    @property
+    def current_max_length(self) -> int:
+        if self.policy is not None:
+            return self.policy.max_length_for(self.emitted)
+        return self.max_length
+
+
+    def is_boundary(self, start: int, end: int) -> bool:
+        """
+        判断标点run [start, end) 是否构成断句点
+
+        排除小数和千分位（3.14、1,000）、时间（10:30）、英文缩写（Mr.、e.g.）、
+        单字母缩写（J. K.）、网址和连字符（example.com、state-of-the-art）。
+        """
+        buffer = self.buffer
+        run = buffer[start:end]
+        prev = buffer[start - 1] if start > 0 else ""
+        following = buffer[end] if end < len(buffer) else ""
+
+        if run in (".", ",", ":") and prev.isdigit() and following.isdigit():
+            return False
+
+        if run == "-":
+            return prev.isspace() and following.isspace()
+
+        if run == ".":
+            if following.isascii() and following.isalnum():
+                return False
+            word = WORD_BEFORE.search(buffer, max(start - 8, 0), start).group()
+            if word.lower().strip(".") in ABBREVIATIONS:
+                return False
+            if len(word) == 1 and word.isupper() and word not in "AI":
+                return False
+
+        return True
+
+
+    def split(self, position: int) -> str:
+        sentence = self.buffer[:position]
+        self.buffer = self.buffer[position:]
+        self.scan = max(self.scan - position, 0)
+        self.boundary = 0
+        self.emitted += 1
+        return sentence
+
+
+    def feed(self, text: str) -> list[str]:
+        """
+        追加文本并返回可以切分出的句子
 
+        Args:
+            text: 新到达的文本片段
 
-async def sentence_segment(text_stream):
+        Returns:
+            list[str]: 切分出的句子，可能为空
+        """
+        self.buffer += text
+        buffer = self.buffer
+
+        for match in PUNCTUATION.finditer(buffer, self.scan):
+            start, end = match.span()
+            if end == len(buffer) and buffer[end - 1] not in IMMEDIATE:
+                # 末尾的标点可能是小数点、缩写或省略号的一部分，等下一段文本到达后重新判断
+                self.scan = start
+                break
+            if self.is_boundary(start, end):
+                self.boundary = end
+            self.scan = end
+        else:
+            self.scan = len(buffer)
+
+        sentences = []
+        if self.boundary >= self.current_min_length:
+            sentences.append(self.split(self.boundary))
+
+        while len(self.buffer) >= self.current_max_length:
+            max_length = self.current_max_length
+            position = self.boundary
+            if not position:
+                space = self.buffer.rfind(" ", 0, max_length)
+                position = space + 1 if space > 0 else max_length
+            sentences.append(self.split(position))
+
+        return [s for s in sentences if s.strip()]
+
+
+    def flush(self) -> list[str]:
+        """
+        结束分割，返回缓冲区中剩余的文本
+        """
+        sentence, self.buffer = self.buffer, ""
+        self.scan = 0
+        self.boundary = 0
+        return [sentence] if sentence.strip() else []
+
+
+async def sentence_segment(text_stream, policy: AdaptiveChunkPolicy | None = None):
     """
     句子分割器
-    
+
     将连续的文本流按照标点符号分割成自然句子，支持中英文标点。
     当累积的文本中含有标点且长度适中时，产生一个新的句子。
-    
+
     Args:
         text_stream: 输入的文本流，异步生成器格式
-        
+        policy: 自适应分句策略，为空时使用配置中的固定长度
+
     Returns:
         AsyncGenerator: 分割后的句子流，每个元素是一个自然句子
-        
+
     Yields:
         str: 分割出的完整句子
         None: 当所有文本处理完毕时
     """
-    buffer = ""
-    punctuations = ',.?!:-，。？！：、'
+    segmenter = SentenceSegmenter(
+        min_length=config.get("min_length", 20),
+        max_length=config.get("max_length", 80),
+        first_min_length=config.get("first_min_length"),
+        policy=policy,
+    )
+
     async for chunk in text_stream:
         if chunk is None:
             break
-        buffer += chunk
-        last_punctuation = max(
-            (buffer.rfind(p) for p in punctuations),
-            default=-1
-        )
-        if not last_punctuation == -1 and len(buffer[:last_punctuation + 1]) > 20:
-            logging.info(f"tokenizer: {buffer[:last_punctuation + 1]}")
-            yield buffer[:last_punctuation + 1]
-            buffer = buffer[last_punctuation + 1:]
-    
-    if buffer:
-        logging.info(f"tokenizer: {buffer}")
-        yield buffer
-        
+        for sentence in segmenter.feed(chunk):
+            logging.info(f"tokenizer: {sentence}")
+            yield sentence
+
+    for sentence in segmenter.flush():
+        logging.info(f"tokenizer: {sentence}")
+        yield sentence
+
     yield None
@@ -478,7 +478,7 @@ def create_ui():
         with gr.TabItem("播放器配置"):
             with gr.Group():
                 player_mode = gr.Radio(
-                    choices=["local", "audio2face"],
+                    choices=["local", "pcm", "null", "audio2face"],
                     value=config['Player']['mode'],
                     label="播放器模式"
                 )